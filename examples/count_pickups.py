@@ -4,23 +4,11 @@ from tml.tml import Teemap
 from tml.constants import TML_DIR, TILEINDEX
 
 map_path = os.sep.join([TML_DIR, '/maps/dm1'])
-t = Teemap(map_path)
-pickups = {
-    'shotgun': 0,
-    'grenade': 0,
-    'rifle': 0,
-    'ninja': 0,
-    'health': 0,
-    'armor': 0,
-    # 'solid': 0,
-    # 'air': 0,
-    # 'death': 0,
-    # 'nohook': 0,
-}
-for tile in t.gamelayer.tiles:
-    for key, value in pickups.iteritems():
-        if tile.index == TILEINDEX[key]:
-            pickups[key] += 1
+t = Teemap(map_path, only='gamelayer')
+pickups = ['shotgun', 'grenade', 'rifle', 'ninja', 'health', 'armor']
+# 'solid', 'air', 'death', 'nohook'
+histogram = t.gamelayer.histogram()
 
-for k, v in pickups.iteritems():
-    print '{value:3}x {key}'.format(value=v, key=k)
+for key in pickups:
+    print '{value:3}x {key}'.format(value=histogram.get(TILEINDEX[key], 0),
+                                    key=key)
@@ -33,6 +33,7 @@ setup(
     packages = find_packages(),
     include_package_data = True,
     install_requires=read_file('requirements.txt'),
+    extras_require={'numpy': ['numpy']},
     classifiers = [
         'License :: OSI Approved :: GNU General Public License (GPL)',
     ],
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+    Process-wide cache for loaded maps.
+
+    :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
+    :license: GNU GPL, see LICENSE for more details.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import threading
+
+from datafile import DataFileReader, _get_map_path
+from tml import Teemap
+
+class TeemapCache(object):
+    """Keeps loaded maps in memory and evicts the least recently used ones.
+
+    A cached map is invalidated when the modification time or the size of
+    its file changes, and with `check_hash` also when the content changes.
+
+    :param max_entries: Maximum number of cached maps.
+    :param max_memory: Maximum memory in bytes, estimated from the size of
+                       the map files and their uncompressed data.
+    :param check_hash: Compare the SHA-1 of the file content on every load.
+                       Reads the whole file, but also notices changes which
+                       keep mtime and size.
+    """
+
+    def __init__(self, max_entries=16, max_memory=256*1024*1024,
+                 check_hash=False):
+        self.max_entries = max_entries
+        self.max_memory = max_memory
+        self.check_hash = check_hash
+        self.memory = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def load(self, map_path, copy=False):
+        """Returns the map at `map_path`, loading it only if necessary.
+
+        The returned map is shared with every other caller, treat it as read
+        only: a change is visible to all callers, but not to the file, and
+        stays until the map is evicted. Pass `copy` whenever you want to
+        modify the map, you then get a private map. It is parsed lazily from
+        the cached file content, so its data is only decompressed when it is
+        accessed.
+
+        Maps are parsed without holding the lock of the cache, a slow load
+        does not block other callers.
+
+        :param map_path: Path to the map, the extension can be omitted.
+        :param copy: Return a private copy of the map, which can be modified.
+        :returns: :class:`Teemap <tml.tml.Teemap>`
+        """
+        path = _get_map_path(map_path)
+        if path is None:
+            raise TypeError('Invalid file')
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        stamp = (stat.st_mtime, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(path)
+        data = None
+        if entry is not None and entry['stamp'] == stamp and self.check_hash:
+            with open(path, 'rb') as f:
+                data = f.read()
+            if hashlib.sha1(data).digest() != entry['digest']:
+                entry = None
+        if entry is not None and entry['stamp'] == stamp:
+            with self._lock:
+                self.hits += 1
+                if self._entries.get(path) is entry:
+                    # mark as recently used
+                    del self._entries[path]
+                    self._entries[path] = entry
+        else:
+            if data is None:
+                with open(path, 'rb') as f:
+                    data = f.read()
+            teemap = Teemap.from_bytes(data)
+            teemap.name = os.path.splitext(os.path.basename(path))[0]
+            size = len(data) + sum(DataFileReader(data=data, load=False).data_sizes)
+            entry = {
+                'stamp': stamp,
+                'digest': hashlib.sha1(data).digest(),
+                'data': data,
+                'teemap': teemap,
+                'size': size,
+            }
+            with self._lock:
+                self.misses += 1
+                current = self._entries.pop(path, None)
+                if current is not None:
+                    if current['stamp'] == stamp and \
+                       current['digest'] == entry['digest']:
+                        # loaded by another caller in the meantime
+                        entry = current
+                    else:
+                        self.memory -= current['size']
+                if entry is not current:
+                    self.memory += entry['size']
+                self._entries[path] = entry
+                self._evict()
+        if copy:
+            teemap = Teemap.from_bytes(entry['data'], lazy=True)
+            teemap.name = entry['teemap'].name
+            return teemap
+        return entry['teemap']
+
+    def _evict(self):
+        """Removes the least recently used maps until the limits are met."""
+        while self._entries and (len(self._entries) > self.max_entries or
+                                 self.memory > self.max_memory):
+            path, entry = self._entries.popitem(last=False)
+            self.memory -= entry['size']
+            self.evictions += 1
+
+    def invalidate(self, map_path):
+        """Removes the map at `map_path` from the cache."""
+        path = os.path.abspath(_get_map_path(map_path) or map_path)
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.memory -= entry['size']
+
+    def clear(self):
+        """Removes all maps and resets the counters."""
+        with self._lock:
+            self._entries.clear()
+            self.memory = 0
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    @property
+    def stats(self):
+        """Dictionary with the counters and the current usage."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self._entries),
+            'memory': self.memory,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<TeemapCache ({0})>'.format(len(self))
+
+#: The process-wide cache used by :func:`load`.
+default_cache = TeemapCache()
+
+def load(map_path, copy=False):
+    """Loads a map through the process-wide :data:`default_cache`.
+
+    See :meth:`TeemapCache.load`.
+    """
+    return default_cache.load(map_path, copy)
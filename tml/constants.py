@@ -26,6 +26,9 @@ TILEFLAG_ROTATE = 8
 
 LAYERFLAG_DETAIL = 1
 
+CURVETYPE_STEP, CURVETYPE_LINEAR, CURVETYPE_SLOW, CURVETYPE_FAST, \
+    CURVETYPE_SMOOTH = range(5)
+
 TILEINDEX  = {
     'air': 0,
     'solid': 1,
@@ -6,12 +6,100 @@
     :license: GNU GPL, see LICENSE for more details.
 """
 
-from struct import pack, unpack
-from zlib import compress, decompress
+from array import array
+from contextlib import contextmanager
+from itertools import izip
+from cStringIO import StringIO
+import hashlib
+import mmap
+import stat
+import sys
+from struct import pack, unpack, unpack_from
+from zlib import compressobj, decompress, DEFLATED, MAX_WBITS, \
+     Z_DEFAULT_COMPRESSION, Z_DEFAULT_STRATEGY, Z_FILTERED, Z_HUFFMAN_ONLY
 
 from constants import *
 import items
-from utils import ints_to_string, string_to_ints
+from utils import ints_to_string, string_to_ints, parallel_map, \
+     parallel_imap, expand_skip_tiles, encode_skip_tiles
+
+def _get_map_path(map_path):
+    """Returns the path with the default extension or ``None`` if the path
+    has another extension."""
+    path, filename = os.path.split(map_path)
+    name, extension = os.path.splitext(filename)
+    if extension == '':
+        return os.extsep.join([map_path, 'map'])
+    elif extension != ''.join([os.extsep, 'map']):
+        return None
+    return map_path
+
+@contextmanager
+def _open_for_writing(map_path, replace=False):
+    """Opens the path for writing, file-like objects are passed through and
+    not closed afterwards.
+
+    With `replace` the data is written to a temporary file which replaces
+    the file at the end, so a lazily loaded map can be saved to its own path
+    while its data is still read from the old file. Symlinks are followed
+    and the mode of the file is kept.
+    """
+    if hasattr(map_path, 'write'):
+        yield map_path
+    elif not replace:
+        with open(map_path, 'wb') as f:
+            yield f
+    else:
+        map_path = os.path.realpath(map_path)
+        tmp_path = '{0}.tmp'.format(map_path)
+        # errors while opening are raised unchanged, there is nothing to
+        # clean up yet
+        f = open(tmp_path, 'wb')
+        try:
+            with f:
+                yield f
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(map_path).st_mode))
+        except:
+            exc_info = sys.exc_info()
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise exc_info[0], exc_info[1], exc_info[2]
+        try:
+            os.rename(tmp_path, map_path)
+        except OSError:
+            # windows does not replace existing files
+            os.remove(map_path)
+            os.rename(tmp_path, map_path)
+
+#: Signature of the uncompressed sidecar files written by :func:`write_sidecar`.
+SIDECAR_SIGNATURE = 'TMLR'
+
+Z_RLE = 3 # not exported by the zlib module of python 2
+
+#: zlib settings ``(level, memory level, strategy)`` tried for each block by
+#: the compression modes of :class:`DataFileWriter`, the smallest result is
+#: kept.
+COMPRESSION_MODES = {
+    'fast': [(1, 8, Z_DEFAULT_STRATEGY)],
+    'default': [(Z_DEFAULT_COMPRESSION, 8, Z_DEFAULT_STRATEGY)],
+    'smallest': [
+        (6, 9, Z_DEFAULT_STRATEGY),
+        (9, 9, Z_DEFAULT_STRATEGY),
+        (9, 9, Z_FILTERED),
+        (9, 9, Z_RLE),
+        (9, 9, Z_HUFFMAN_ONLY),
+    ],
+}
+
+def _is_seekable(f):
+    """Checks if the file-like object supports seeking."""
+    try:
+        f.seek(f.tell())
+    except (AttributeError, IOError):
+        return False
+    return True
 
 class Header(object):
     """Contains fileheader information.
@@ -25,10 +113,13 @@ class Header(object):
     def __init__(self, f=None):
         self.version = 4
         self.size = 0
+        self.raw = False
         if f != None:
             sig = ''.join(unpack('4c', f.read(4)))
-            if sig not in ('DATA', 'ATAD'):
+            if sig not in ('DATA', 'ATAD', SIDECAR_SIGNATURE):
                 raise TypeError('Invalid signature')
+            # sidecars store the data blocks uncompressed
+            self.raw = sig == SIDECAR_SIGNATURE
             self.version, self.size_, self.swaplen, self.num_item_types, \
             self.num_items, self.num_raw_data, self.item_size, \
             self.data_size = unpack('8i', f.read(32))
@@ -42,93 +133,228 @@ class Header(object):
                 (self.num_items + (2 * self.num_raw_data)) * 4 # item offsets, data offsets, uncompressed data sizes
             ])
 
+def _decode_data(data, encoding, size):
+    """Decodes the decompressed data of a block with the given encoding.
+
+    :param encoding: ``None`` for raw data or ``'skip'`` for tiles encoded
+                     with their skip field.
+    :param size: Size of the decoded data in bytes.
+    """
+    if encoding == 'skip':
+        return expand_skip_tiles(data, size / 4)
+    return data
+
+class LazyData(object):
+    """Reference to a compressed data block of a datafile.
+
+    The block is only decompressed when :meth:`load` is called, the size is
+    known beforehand from the uncompressed data sizes.
+
+    :param datafile: The :class:`DataFileReader` the block belongs to.
+    :param index: Index of the data block.
+    :param encoding: Encoding of the block, see :func:`_decode_data`.
+    :param size: Size of the decoded data, required for encoded blocks.
+    """
+
+    def __init__(self, datafile, index, encoding=None, size=None):
+        self.datafile = datafile
+        self.index = index
+        self.encoding = encoding
+        self.size = size
+
+    @property
+    def offset(self):
+        """Position of the compressed block in the file."""
+        return self.datafile.header.size + self.datafile.header.item_size + \
+               self.datafile.data_offsets[self.index]
+
+    def load(self):
+        """Decompresses and decodes the block and returns it as string."""
+        return _decode_data(self.datafile.decompress_data(self.index),
+                            self.encoding, self.size)
+
+    def get_compressed(self):
+        """Returns the compressed block and its uncompressed size or ``None``
+        if the datafile stores the block uncompressed."""
+        if self.datafile.header.raw:
+            return None
+        return (self.datafile.get_compressed_data(self.index),
+                self.datafile.data_sizes[self.index])
+
+    def __len__(self):
+        if self.size is not None:
+            return self.size
+        return self.datafile.data_sizes[self.index]
+
+    def __repr__(self):
+        return '<LazyData ({0})>'.format(self.index)
+
+class CompressedData(object):
+    """Copy of a compressed data block which does not depend on the datafile.
+
+    :param data: The compressed data.
+    :param size: Size of the uncompressed data.
+    :param encoding: Encoding of the uncompressed data, see
+                     :func:`_decode_data`. It is not decoded by :meth:`load`.
+    """
+
+    def __init__(self, data, size, encoding=None):
+        self.data = data
+        self.size = size
+        self.encoding = encoding
+
+    def load(self):
+        """Decompresses the data and returns it."""
+        return decompress(self.data)
+
+    def get_compressed(self):
+        """Returns the compressed data and its uncompressed size."""
+        return (self.data, self.size)
+
+    def __len__(self):
+        return self.size
+
+    def __repr__(self):
+        return '<CompressedData ({0})>'.format(self.size)
+
 class DataFileReader(object):
+    """Reads a teeworlds datafile.
 
-    def __init__(self, map_path):
+    :param map_path: Path to the map, the extension can be omitted. Can also
+                     be a file-like object opened in binary mode.
+    :param lazy: Do not decompress tile and quad data while loading, it
+                 will be decompressed when it is accessed for the first
+                 time. The map file must not be changed in the meanwhile.
+    :param load: Load all items. If ``False``, only the header and the item
+                 table are read and the file stays mapped until
+                 :meth:`close` is called.
+    :param data: Content of a map file as string, used instead of
+                 `map_path`.
+    :param threads: Number of threads used to decompress the data blocks.
+                    Has no effect for lazily loaded files.
+    :param only: Load only a part of the map. Either a callable which gets
+                 passed each layer (with its data not yet decompressed) and
+                 returns if the layer should be loaded, or a name or list of
+                 names out of :attr:`LOAD_PARTS`. Everything else is skipped,
+                 so do not save maps loaded with this option.
+
+    Files given by path are memory-mapped, items and data blocks are read
+    straight from the mapping without copying them. Unless the file is
+    loaded lazily it gets unmapped when loading is finished. File-like
+    objects are read completely into memory.
+    """
+
+    #: Names of the parts which can be selected with the `only` parameter.
+    LOAD_PARTS = ('info', 'images', 'envelopes', 'layers', 'tilelayers',
+                  'quadlayers', 'gamelayer')
+
+    def __init__(self, map_path=None, lazy=False, load=True, data=None,
+                 threads=1, only=None):
+        self.lazy = lazy
+        self._parts = None
+        self._layer_filter = None
+        if callable(only):
+            self._layer_filter = only
+        elif only is not None:
+            if isinstance(only, basestring):
+                only = [only]
+            self._parts = set(only)
+            for part in self._parts:
+                if part not in self.LOAD_PARTS:
+                    raise ValueError('Unknown part "{0}"'.format(part))
+        #: ``True`` if parts of the map are skipped.
+        self.partial = self._layer_filter is not None or \
+            (self._parts is not None and not self._parts.issuperset(
+                ('info', 'images', 'envelopes', 'layers')))
+        # with a filter or multiple threads the layer data is decompressed
+        # after all layers are known
+        self._pending = None
+        if not lazy and (threads > 1 or only is not None):
+            self._pending = []
         # default list of item types
         for type_ in ITEM_TYPES:
             if type_ != 'version' and type_ != 'layer':
                 setattr(self, ''.join([type_, 's']), [])
 
-        path, filename = os.path.split(map_path)
-        self.name, extension = os.path.splitext(filename)
-        if extension == '':
-            self.map_path = os.extsep.join([map_path, 'map'])
-        elif extension != ''.join([os.extsep, 'map']):
-            raise TypeError('Invalid file')
+        self.map_path = None
+        #: The path of the mapped file, if the data is read from one.
+        self.mapped_path = None
+        self.name = ''
+        if data is not None:
+            self.data = data
+        elif hasattr(map_path, 'read'):
+            name = getattr(map_path, 'name', None)
+            if isinstance(name, basestring):
+                self.name = os.path.splitext(os.path.basename(name))[0]
+            self.data = map_path.read()
         else:
-            self.map_path = map_path
-
-        with open(self.map_path, 'rb') as f:
-            self.f = f
-            self.header = Header(f)
+            self.map_path = _get_map_path(map_path)
+            if self.map_path is None:
+                raise TypeError('Invalid file')
+            self.name = os.path.splitext(os.path.basename(self.map_path))[0]
+            with open(self.map_path, 'rb') as f:
+                self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mapped_path = self.map_path
+        try:
+            self.header = Header(StringIO(self.data[:36]))
             self.item_types = []
+            self._item_type_index = {}
+            pos = 36
             for i in range(self.header.num_item_types):
-                val = unpack('3i', f.read(12))
+                val = unpack_from('3i', self.data, pos)
+                pos += 12
                 self.item_types.append({
                     'type': val[0],
                     'start': val[1],
                     'num': val[2],
                 })
+                self._item_type_index[val[0]] = (val[1], val[2])
             fmt = '{0}i'.format(self.header.num_items)
-            self.item_offsets = unpack(fmt, f.read(self.header.num_items * 4))
+            self.item_offsets = unpack_from(fmt, self.data, pos)
+            pos += self.header.num_items * 4
             fmt = '{0}i'.format(self.header.num_raw_data)
-            self.data_offsets = unpack(fmt, f.read(self.header.num_raw_data * 4))
+            self.data_offsets = unpack_from(fmt, self.data, pos)
+            pos += self.header.num_raw_data * 4
+            self.data_sizes = unpack_from(fmt, self.data, pos)
+
+            # index the items by type and id
+            self.item_index = {}
+            for i, offset in enumerate(self.item_offsets):
+                type_and_id = unpack_from('i', self.data, self.header.size + offset)[0]
+                self.item_index[((type_and_id>>16)&0xffff, type_and_id&0xffff)] = i
 
             # check version
-            item_size, version_item = self.find_item(f, ITEM_VERSION, 0)
-            fmt = '{0}i'.format(item_size/4)
-            version = unpack(fmt, version_item)[0] # we only expect 1 element here
+            version = self.find_item_ints(ITEM_VERSION, 0)[0] # we only expect 1 element here
             if version != 1:
                 raise ValueError('Wrong version')
 
+            if not load:
+                return
+
             # load items
             # begin with map info
-            item = self.find_item(f, ITEM_INFO, 0)
-            if item is not None:
-                item_size, item_data = item
-                fmt = '{0}i'.format(item_size/4)
-                item_data = unpack(fmt, item_data)
-                version, author, map_version, credits, license, \
-                settings = item_data[:items.Info.type_size]
-                if author > -1:
-                    author = decompress(self.get_compressed_data(f, author))[:-1]
-                else:
-                    author = None
-                if map_version > -1:
-                    map_version = decompress(self.get_compressed_data(f, map_version))[:-1]
-                else:
-                    map_version = None
-                if credits > -1:
-                    credits = decompress(self.get_compressed_data(f, credits))[:-1]
-                else:
-                    credits = None
-                if license > -1:
-                    license = decompress(self.get_compressed_data(f, license))[:-1]
-                else:
-                    license = None
-                if settings > -1:
-                    settings = decompress(self.get_compressed_data(f, settings)).split('\x00')[:-1]
-                else:
-                    settings = None
-                self.info = items.Info(author=author, map_version=map_version,
-                                       credits=credits, license=license,
-                                       settings=settings)
-            else:
-                self.info = None
+            self.info = self.load_info() if self._wants('info') else None
 
             # load images
             start, num = self.get_item_type(ITEM_IMAGE)
+            if not self._wants('images'):
+                num = 0
             for i in range(num):
-                item = self.get_item(f, start+i)
-                item_size, item_data = item
-                fmt = '{0}i'.format(item_size/4)
-                item_data = unpack(fmt, item_data)
+                item_data = self.get_item_ints(start+i)
                 version, width, height, external, image_name, \
                 image_data = item_data[:items.Image.type_size]
                 external = bool(external)
-                name = decompress(self.get_compressed_data(f, image_name))[:-1]
-                data = decompress(self.get_compressed_data(f, image_data)) if not external else None
+                name = self.decompress_data(image_name)[:-1]
+                data = None
+                if not external:
+                    # image data is only decompressed when it is accessed
+                    if self.lazy:
+                        data = LazyData(self, image_data)
+                    elif self.header.raw:
+                        data = str(self.get_compressed_data(image_data))
+                    else:
+                        data = CompressedData(str(self.get_compressed_data(image_data)),
+                                              self.data_sizes[image_data])
                 image = items.Image(external=external, name=name,
                                    data=data, width=width, height=height)
                 self.images.append(image)
@@ -136,9 +362,7 @@ class DataFileReader(object):
             # load groups
             group_item_start, group_item_num = self.get_item_type(ITEM_GROUP)
             for i in range(group_item_num):
-                item_size, item_data = self.get_item(f, group_item_start+i)
-                fmt = '{0}i'.format(item_size/4)
-                item_data = unpack(fmt, item_data)
+                item_data = self.get_item_ints(group_item_start+i)
                 version, offset_x, offset_y, parallax_x, parallax_y, \
                 start_layer, num_layers, use_clipping, clip_x, clip_y, \
                 clip_w, clip_h = item_data[:items.Group.type_size-3]
@@ -153,9 +377,7 @@ class DataFileReader(object):
                 layer_item_start, layer_item_num = self.get_item_type(ITEM_LAYER)
                 layers = []
                 for j in range(num_layers):
-                    item_size, item_data = self.get_item(f, layer_item_start+start_layer+j)
-                    fmt = '{0}i'.format(item_size/4)
-                    item_data = unpack(fmt, item_data)
+                    item_data = self.get_item_ints(layer_item_start+start_layer+j)
                     layer_version, type_, flags = item_data[:items.Layer.type_size]
                     detail = True if flags else False
 
@@ -168,53 +390,47 @@ class DataFileReader(object):
                         name = None
                         if version >= 3:
                             name = ints_to_string(item_data[type_size-3:type_size]) or None
-                        tile_list = []
-                        tile_data = decompress(self.get_compressed_data(f, data))
-                        for i in xrange(0, len(tile_data), 4):
-                            tile_list.append(tile_data[i:i+4])
-                        tiles = items.TileManager(data=tile_list)
+                        # teeworlds 0.7 encodes the tiles with their skip field
+                        encoding = 'skip' if version >= 4 else None
+                        tiles = items.TileManager(data=self.get_data(data, encoding,
+                                                                     width*height*4),
+                                                  source=self.get_source(data, encoding))
                         tele_tiles = None
                         speedup_tiles = None
                         if game == 2:
-                            tele_list = []
                             if version >= 3:
                                 # num of tele data is right after the default type length
                                 if len(item_data) > items.TileLayer.type_size: # some security
                                     tele_data = item_data[items.TileLayer.type_size]
                                     if tele_data > -1 and tele_data < self.header.num_raw_data:
-                                        tele_data = decompress(self.get_compressed_data(f, tele_data))
-                                        for i in xrange(0, len(tele_data), 2):
-                                            tele_list.append(tele_data[i:i+2])
-                                        tele_tiles = items.TileManager(data=tele_list, _type=1)
+                                        tele_tiles = items.TileManager(data=self.get_data(tele_data),
+                                                                       source=self.get_source(tele_data),
+                                                                       _type=1)
                             else:
                                 # num of tele data is right after num of data for old maps
                                 if len(item_data) > items.TileLayer.type_size-3: # some security
                                     tele_data = item_data[items.TileLayer.type_size-3]
                                     if tele_data > -1 and tele_data < self.header.num_raw_data:
-                                        tele_data = decompress(self.get_compressed_data(f, tele_data))
-                                        for i in xrange(0, len(tele_data), 2):
-                                            tele_list.append(tele_data[i:i+2])
-                                        tele_tiles = items.TileManager(data=tele_list, _type=1)
+                                        tele_tiles = items.TileManager(data=self.get_data(tele_data),
+                                                                       source=self.get_source(tele_data),
+                                                                       _type=1)
                         elif game == 4:
-                            speedup_list = []
                             if version >= 3:
                                 # num of speedup data is right after tele data
                                 if len(item_data) > items.TileLayer.type_size+1: # some security
                                     speedup_data = item_data[items.TileLayer.type_size+1]
                                     if speedup_data > -1 and speedup_data < self.header.num_raw_data:
-                                        speedup_data = decompress(self.get_compressed_data(f, speedup_data))
-                                        for i in xrange(0, len(speedup_data), 4):
-                                            speedup_list.append(speedup_data[i:i+4])
-                                        speedup_tiles = items.TileManager(data=speedup_list, _type=2)
+                                        speedup_tiles = items.TileManager(data=self.get_data(speedup_data),
+                                                                          source=self.get_source(speedup_data),
+                                                                          _type=2)
                             else:
                                 # num of speedup data is right after tele data
                                 if len(item_data) > items.TileLayer.type_size-2: # some security
                                     speedup_data = item_data[items.TileLayer.type_size-2]
                                     if speedup_data > -1 and speedup_data < self.header.num_raw_data:
-                                        speedup_data = decompress(self.get_compressed_data(f, speedup_data))
-                                        for i in xrange(0, len(speedup_data), 4):
-                                            speedup_list.append(speedup_data[i:i+4])
-                                        speedup_tiles = items.TileManager(data=speedup_list, _type=2)
+                                        speedup_tiles = items.TileManager(data=self.get_data(speedup_data),
+                                                                          source=self.get_source(speedup_data),
+                                                                          _type=2)
                         layer = items.TileLayer(width=width, height=height,
                                                 name=name, detail=detail, game=game,
                                                 color=tuple(color), color_env=color_env,
@@ -222,21 +438,20 @@ class DataFileReader(object):
                                                 image_id=image_id, tiles=tiles,
                                                 tele_tiles=tele_tiles,
                                                 speedup_tiles=speedup_tiles)
-                        layers.append(layer)
+                        if self._wants_layer(layer):
+                            layers.append(layer)
                     elif type_ == LAYERTYPE_QUADS:
                         type_size = items.QuadLayer.type_size
                         version, num_quads, data, image_id = item_data[3:type_size-3]
                         name = None
                         if version >= 2:
                             name = ints_to_string(item_data[type_size-3:type_size]) or None
-                        quad_data = decompress(self.get_compressed_data(f, data))
-                        quad_list = []
-                        for k in xrange(0, len(quad_data), 152):
-                            quad_list.append(quad_data[k:k+152])
-                        quads = items.QuadManager(data=quad_list)
+                        quads = items.QuadManager(data=self.get_data(data),
+                                                  source=self.get_source(data))
                         layer = items.QuadLayer(name=name, detail=detail,
                                                 image_id=image_id, quads=quads)
-                        layers.append(layer)
+                        if self._wants_layer(layer):
+                            layers.append(layer)
 
                 group = items.Group(name=group_name, offset_x=offset_x,
                                     offset_y=offset_y, parallax_x=parallax_x,
@@ -246,43 +461,137 @@ class DataFileReader(object):
                                     clip_h=clip_h, layers=layers)
                 self.groups.append(group)
 
-            # load envpoints
-            item_size, item = self.find_item(f, ITEM_ENVPOINT, 0)
-            fmt = '{0}i'.format(item_size/4)
-            item = unpack(fmt, item)
-            type_size = items.Envpoint.type_size
-            for i in range(len(item)/6):
-                point = list(item[(i*6):(i*6+6)])
-                time, curvetype = point[:type_size-4]
-                values = point[type_size-4:type_size]
-                envpoint = items.Envpoint(time=time, curvetype=curvetype,
-                                          values=values)
-                self.envpoints.append(envpoint)
-
-            # load envelopes
-            start, num = self.get_item_type(ITEM_ENVELOPE)
-            type_size = items.Envelope.type_size
-            for i in range(num):
-                item_size, item_data = self.get_item(f, start+i)
-                fmt = '{0}i'.format(item_size/4)
-                item_data = unpack(fmt, item_data)
-                version, channels, start_point, \
-                num_point = item_data[:type_size-9]
-                name = ints_to_string(item_data[type_size-9:type_size-1])
-                envpoints = self.envpoints[start_point:start_point+num_point]
-                synced = True if version < 2 or item_data[type_size-1] else False
-                envelope = items.Envelope(name=name, version=version,
-                                          channels=channels,
-                                          envpoints=envpoints,
-                                          synced=synced)
-                self.envelopes.append(envelope)
+            # decompress the data of the selected layers
+            if self._pending is not None:
+                for group in self.groups:
+                    for layer in group.layers:
+                        if layer.type == 'tilelayer':
+                            managers = [layer.tiles, layer.tele_tiles,
+                                        layer.speedup_tiles]
+                        else:
+                            managers = [layer.quads]
+                        self._pending.extend(manager for manager in managers
+                                             if manager is not None)
+                parallel_map(lambda manager: manager.load(), self._pending,
+                             threads)
+                self._pending = None
+
+            if self._wants('envelopes'):
+                # load envpoints
+                self.envpoints = self.load_envpoints()
+
+                # load envelopes
+                self.envelopes = self.load_envelopes(self.envpoints)
+        finally:
+            if load and not self.lazy:
+                self.close()
+
+    def _wants(self, part):
+        """Checks if the part of the map should be loaded."""
+        return self._parts is None or part in self._parts
+
+    def _wants_layer(self, layer):
+        """Checks if the layer should be loaded."""
+        if self._layer_filter is not None:
+            return self._layer_filter(layer)
+        if self._parts is None or 'layers' in self._parts:
+            return True
+        if layer.type == 'tilelayer' and 'tilelayers' in self._parts:
+            return True
+        if layer.type == 'quadlayer' and 'quadlayers' in self._parts:
+            return True
+        return layer.is_gamelayer and 'gamelayer' in self._parts
+
+    def load_info(self):
+        """Returns the map :class:`Info <tml.items.Info>` or ``None`` if the
+        map has no info item."""
+        item_data = self.find_item_ints(ITEM_INFO, 0)
+        if item_data is not None:
+            version, author, map_version, credits, license, \
+            settings = item_data[:items.Info.type_size]
+            if author > -1:
+                author = self.decompress_data(author)[:-1]
+            else:
+                author = None
+            if map_version > -1:
+                map_version = self.decompress_data(map_version)[:-1]
+            else:
+                map_version = None
+            if credits > -1:
+                credits = self.decompress_data(credits)[:-1]
+            else:
+                credits = None
+            if license > -1:
+                license = self.decompress_data(license)[:-1]
+            else:
+                license = None
+            if settings > -1:
+                settings = self.decompress_data(settings).split('\x00')[:-1]
+            else:
+                settings = None
+            return items.Info(author=author, map_version=map_version,
+                              credits=credits, license=license,
+                              settings=settings)
+        return None
+
+    def load_envpoints(self):
+        """Returns all envpoints in an :class:`EnvpointManager
+        <tml.items.EnvpointManager>`."""
+        item = self.find_item(ITEM_ENVPOINT, 0)
+        if item is None:
+            return items.EnvpointManager()
+        size, data = item
+        type_size = items.Envpoint.type_size * 4
+        return items.EnvpointManager(data=data[:size - size % type_size])
+
+    def load_envelopes(self, envpoints):
+        """Returns the list of all :class:`envelopes <tml.items.Envelope>`.
+
+        :param envpoints: The envpoints returned by :meth:`load_envpoints`,
+                          the envelopes get views of them.
+        """
+        envelopes = []
+        start, num = self.get_item_type(ITEM_ENVELOPE)
+        type_size = items.Envelope.type_size
+        for i in range(num):
+            item_data = self.get_item_ints(start+i)
+            version, channels, start_point, \
+            num_point = item_data[:type_size-9]
+            name = ints_to_string(item_data[type_size-9:type_size-1])
+            synced = True if version < 2 or item_data[type_size-1] else False
+            envelope = items.Envelope(name=name, version=version,
+                                      channels=channels,
+                                      envpoints=envpoints.view(start_point, num_point),
+                                      synced=synced)
+            envelopes.append(envelope)
+        return envelopes
+
+    def get_image_names(self):
+        """Returns the names of all images without loading the image data."""
+        names = []
+        start, num = self.get_item_type(ITEM_IMAGE)
+        for i in range(num):
+            image_name = self.get_item_ints(start+i)[4]
+            names.append(self.decompress_data(image_name)[:-1])
+        return names
+
+    def get_gamelayer_size(self):
+        """Returns width and height of the first gamelayer or ``None``."""
+        start, num = self.get_item_type(ITEM_LAYER)
+        for i in range(num):
+            item_data = self.get_item_ints(start+i)
+            if item_data[1] == LAYERTYPE_TILES and item_data[6] == 1:
+                return item_data[4:6]
+        return None
+
+    def close(self):
+        """Unmaps the file. Lazily loaded data can not be accessed anymore."""
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
 
     def get_item_type(self, item_type):
         """Returns the index of the first item and the number of items for the type."""
-        for i in range(self.header.num_item_types):
-            if self.item_types[i]['type'] == item_type:
-                return (self.item_types[i]['start'], self.item_types[i]['num'])
-        return (0, 0)
+        return self._item_type_index.get(item_type, (0, 0))
 
     def _get_item_size(self, index):
         """Returns the size of the item."""
@@ -290,37 +599,193 @@ class DataFileReader(object):
             return (self.header.item_size - self.item_offsets[index]) - 8   # -8 to cut out type_and_id and size
         return (self.item_offsets[index+1] - self.item_offsets[index]) - 8
 
-    def get_item(self, f, index):
-        """Returns the item from the file."""
+    def get_item(self, index):
+        """Returns the size of the item and a buffer of its data, the data
+        is not copied."""
         if index < self.header.num_items:
-            f.seek(self.header.size + self.item_offsets[index] + 8) # +8 to cut out type_and_id and size
+            offset = self.header.size + self.item_offsets[index] + 8 # +8 to cut out type_and_id and size
             size = self._get_item_size(index)
-            return (size, f.read(size))
+            return (size, buffer(self.data, offset, size))
         return None
 
-    def find_item(self, f, item_type, index):
+    def get_item_ints(self, index):
+        """Returns the data of the item as tuple of ints."""
+        if index < self.header.num_items:
+            offset = self.header.size + self.item_offsets[index] + 8
+            fmt = '{0}i'.format(self._get_item_size(index)/4)
+            return unpack_from(fmt, self.data, offset)
+        return None
+
+    def find_item(self, item_type, index):
         """Finds the item and returns it from the file.
 
-        :param f: Filepointer
         :param item_type:
         :param index:
         """
         start, num = self.get_item_type(item_type)
         if num and index < num:
-            return self.get_item(f, start+index)
+            return self.get_item(start+index)
         return None
 
+    def find_item_ints(self, item_type, index):
+        """Like :meth:`find_item`, but returns the data as tuple of ints."""
+        start, num = self.get_item_type(item_type)
+        if num and index < num:
+            return self.get_item_ints(start+index)
+        return None
+
+    def get_raw_item(self, item_type, id_):
+        """Returns the data of the item with the given type and id as tuple
+        of ints or ``None`` if there is no such item."""
+        index = self.item_index.get((item_type, id_))
+        if index is None:
+            return None
+        return self.get_item_ints(index)
+
+    def iter_items(self, item_type=None):
+        """Iterates over the raw items in the order of the file.
+
+        :param item_type: Only yield items of this type.
+        :returns: Generator of ``(type, id, ints)`` tuples
+        """
+        if item_type is None:
+            start, num = 0, self.header.num_items
+        else:
+            start, num = self.get_item_type(item_type)
+        for index in xrange(start, start+num):
+            type_and_id = unpack_from('i', self.data,
+                                      self.header.size + self.item_offsets[index])[0]
+            yield ((type_and_id>>16)&0xffff, type_and_id&0xffff,
+                   self.get_item_ints(index))
+
+    def iter_data(self):
+        """Iterates over the raw data blocks without decompressing them.
+
+        :returns: Generator of ``(index, compressed data, uncompressed size)``
+                  tuples, the compressed data is a buffer into the file.
+        """
+        for index in xrange(self.header.num_raw_data):
+            yield (index, self.get_compressed_data(index), self.data_sizes[index])
+
     def _get_compressed_data_size(self, index):
         """Returns the size of the compressed data part."""
         if index == self.header.num_raw_data - 1:
             return self.header.data_size - self.data_offsets[index]
         return self.data_offsets[index+1] - self.data_offsets[index]
 
-    def get_compressed_data(self, f, index):
-        """Returns the compressed data and size of it from the file."""
+    def get_compressed_data(self, index):
+        """Returns a buffer of the compressed data, the data is not copied."""
         size = self._get_compressed_data_size(index)
-        f.seek(self.header.size + self.header.item_size + self.data_offsets[index])
-        return f.read(size)
+        offset = self.header.size + self.header.item_size + self.data_offsets[index]
+        return buffer(self.data, offset, size)
+
+    def decompress_data(self, index):
+        """Returns the decompressed data."""
+        if self.header.raw:
+            return self.get_compressed_data(index)[:]
+        return decompress(self.get_compressed_data(index))
+
+    def get_data(self, index, encoding=None, size=None):
+        """Returns the data decoded with `encoding` (see :class:`LazyData`)
+        as string or a :class:`LazyData` reference to it if the datafile is
+        loaded lazily."""
+        if self.lazy or self._pending is not None:
+            return LazyData(self, index, encoding, size)
+        return _decode_data(self.decompress_data(index), encoding, size)
+
+    def get_source(self, index, encoding=None):
+        """Returns a reference to the compressed data block, which is copied
+        when the data is saved unmodified, or ``None`` for sidecars.
+
+        Unless the datafile is loaded lazily the compressed data is copied,
+        because the file is unmapped after loading.
+
+        :param encoding: Encoding of the block, the writer only copies the
+                         block if it uses the same encoding.
+        """
+        if self.header.raw:
+            return None
+        if self.lazy:
+            return LazyData(self, index, encoding)
+        return CompressedData(str(self.get_compressed_data(index)),
+                              self.data_sizes[index], encoding)
+
+def write_sidecar(datafile, f):
+    """Writes an uncompressed copy of the datafile to `f`.
+
+    The copy has the same layout as the datafile, but starts with
+    :data:`SIDECAR_SIGNATURE` and stores every data block uncompressed, so it
+    can be memory-mapped and read without inflating anything. Items are
+    copied unchanged.
+
+    :param datafile: A :class:`DataFileReader` which is not closed yet.
+    :param f: File opened for writing in binary mode.
+    """
+    header = datafile.header
+    data_size = sum(datafile.data_sizes)
+    file_size = header.size + header.item_size + data_size - 16
+    f.write(SIDECAR_SIGNATURE)
+    f.write(pack('8i', header.version, file_size, file_size - data_size,
+                 header.num_item_types, header.num_items, header.num_raw_data,
+                 header.item_size, data_size))
+    for item_type in datafile.item_types:
+        f.write(pack('3i', item_type['type'], item_type['start'], item_type['num']))
+    f.write(pack('{0}i'.format(header.num_items), *datafile.item_offsets))
+    offsets = []
+    offset = 0
+    for size in datafile.data_sizes:
+        offsets.append(offset)
+        offset += size
+    fmt = '{0}i'.format(header.num_raw_data)
+    f.write(pack(fmt, *offsets))
+    f.write(pack(fmt, *datafile.data_sizes))
+    f.write(datafile.data[header.size:header.size+header.item_size])
+    for index in xrange(header.num_raw_data):
+        f.write(datafile.decompress_data(index))
+
+def read_cached(map_path, cache_dir, **kwargs):
+    """Reads a map using an uncompressed sidecar file from `cache_dir`.
+
+    The sidecar is named after the SHA-1 of the map content. If it does not
+    exist yet, it gets written by :func:`write_sidecar`. The sidecar is
+    memory-mapped and passed to :class:`DataFileReader`, so no data has to be
+    inflated.
+
+    :param map_path: Path to the map, the extension can be omitted.
+    :param cache_dir: Directory for the sidecar files, it is created if
+                      necessary.
+    :param kwargs: Passed to :class:`DataFileReader`.
+    :returns: :class:`DataFileReader`
+    """
+    path = _get_map_path(map_path)
+    if path is None:
+        raise TypeError('Invalid file')
+    with open(path, 'rb') as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    sidecar_path = os.path.join(cache_dir, os.extsep.join([digest, 'tmlr']))
+    if not os.path.exists(sidecar_path):
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        datafile = DataFileReader(path, load=False)
+        try:
+            # write to a temporary file first, so readers never see a partial sidecar
+            tmp_path = '{0}.{1}.tmp'.format(sidecar_path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                write_sidecar(datafile, f)
+        finally:
+            datafile.close()
+        try:
+            os.rename(tmp_path, sidecar_path)
+        except OSError:
+            # written by another process in the meanwhile, windows does
+            # not replace existing files
+            os.remove(tmp_path)
+    with open(sidecar_path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    datafile = DataFileReader(data=data, **kwargs)
+    datafile.map_path = path
+    datafile.name = os.path.splitext(os.path.basename(path))[0]
+    return datafile
 
 class DataFileWriter(object):
 
@@ -343,22 +808,118 @@ class DataFileWriter(object):
             return '<DataFileItem ({0})>'.format((self.type<<16)|self.id)
 
     class DataFileData(object):
+        """Uncompressed data block, either a string, a bytearray (tiles) or
+        an array (quads).
+
+        Blocks created with :meth:`from_source` are already compressed.
+        Identical blocks have the same :attr:`key`, except for blocks which
+        teeworlds changes in place after loading them, see :attr:`unique`.
+        """
 
         def __init__(self, data):
-            self.uncompressed_size = len(data)
-            self.data = compress(data)
-            self.compressed_size = len(self.data)
-
-    def __init__(self, teemap, map_path):
-        path, filename = os.path.split(map_path)
-        name, extension = os.path.splitext(filename)
-        if extension == '':
-            map_path = os.extsep.join([map_path, 'map'])
-        elif extension != ''.join([os.extsep, 'map']):
-            raise ValueError('Invalid fileextension')
+            self.data = data
+            self.compressed = None
+            # arrays (e.g. quads) have items larger than one byte
+            self.uncompressed_size = len(data) * getattr(data, 'itemsize', 1)
+            self.encoding = None
+            #: Never share the block with an identical one, set for the
+            #: tiles of the gamelayer, which the client turns into collision
+            #: flags in place.
+            self.unique = False
+            self._key = None
+
+        def _get_data(self):
+            """Returns the uncompressed data without copying it."""
+            if self.data is None:
+                return decompress(self.compressed)
+            return buffer(self.data)
+
+        @property
+        def key(self):
+            """Hash of the uncompressed data, or of the compressed data for
+            copied blocks."""
+            if self._key is None:
+                sha1 = hashlib.sha1()
+                if self.compressed is not None:
+                    sha1.update(self.compressed)
+                else:
+                    sha1.update(self._get_data())
+                self._key = (self.compressed is not None, self.uncompressed_size,
+                             sha1.digest())
+                if self.unique or self.encoding == 'skip':
+                    # teeworlds changes these blocks in place, e.g. expands
+                    # skip encoded tiles, every layer needs its own block
+                    self._key += (id(self),)
+            return self._key
+
+        @classmethod
+        def from_source(cls, obj, get_data, encoding=None):
+            """Returns the block of a manager or an image, the compressed data
+            is copied from the loaded map if it is unmodified.
+
+            :param obj: A :class:`TileManager <tml.items.TileManager>`,
+                        :class:`QuadManager <tml.items.QuadManager>` or
+                        :class:`Image <tml.items.Image>`.
+            :param get_data: Returns the data of `obj` if it must be
+                             compressed.
+            :param encoding: Encoding of the data returned by `get_data`,
+                             the source is only copied if it has the same.
+            """
+            compressed = None
+            source = obj.source
+            if source is not None and source.encoding == encoding:
+                compressed = source.get_compressed()
+            if compressed is None:
+                data = cls(get_data())
+            else:
+                data = cls('')
+                data.data = None
+                data.compressed = str(compressed[0])
+                data.uncompressed_size = compressed[1]
+            data.encoding = encoding
+            return data
+
+        def compress_data(self, settings=None):
+            """Returns the compressed data.
+
+            :param settings: zlib settings out of :data:`COMPRESSION_MODES`.
+                             If ``None``, already compressed data is returned
+                             as it is, other data is compressed with the
+                             default settings.
+            """
+            if settings is None:
+                if self.compressed is not None:
+                    return self.compressed
+                compressor = compressobj()
+            else:
+                level, mem_level, strategy = settings
+                compressor = compressobj(level, DEFLATED, MAX_WBITS, mem_level,
+                                         strategy)
+            return compressor.compress(self._get_data()) + compressor.flush()
+
+    def __init__(self, teemap, map_path, threads=1, compression='default',
+                 skip_tiles=False):
+        if not hasattr(map_path, 'write'):
+            map_path = _get_map_path(map_path)
+            if map_path is None:
+                raise ValueError('Invalid fileextension')
+        if compression not in COMPRESSION_MODES:
+            raise ValueError('Unknown compression "{0}"'.format(compression))
+        self.compression = compression
         teemap.validate()
         items_ = []
         datas = []
+        data_indices = {}
+
+        def add_data(data):
+            """Adds the data block unless an identical one was added before
+            and returns the index of the block."""
+            index = data_indices.get(data.key)
+            if index is None:
+                index = data_indices[data.key] = len(datas)
+                datas.append(data)
+            return index
+
         # add version item
         items_.append(DataFileWriter.DataFileItem(ITEM_VERSION, 0, pack('i', 1)))
         # save map info
@@ -367,26 +928,22 @@ class DataFileWriter(object):
             for i, type_ in enumerate(['author', 'map_version', 'credits', 'license']):
                 item_data = getattr(teemap.info, type_)
                 if item_data:
-                    num[i] = len(datas)
                     item_data += '\x00' # 0 termination
-                    datas.append(DataFileWriter.DataFileData(item_data))
+                    num[i] = add_data(DataFileWriter.DataFileData(item_data))
             if teemap.info.settings:
-                num[4] = len(datas)
-                settings_str = ''
-                for setting in teemap.info.settings:
-                    settings_str += '{0}\x00'.format(setting)
-                datas.append(DataFileWriter.DataFileData(settings_str))
+                settings_str = ''.join(['{0}\x00'.format(setting)
+                                        for setting in teemap.info.settings])
+                num[4] = add_data(DataFileWriter.DataFileData(settings_str))
             items_.append(DataFileWriter.DataFileItem(ITEM_INFO, 0,
                               pack('6i', 1, *num)))
         # save images
         for i, image in enumerate(teemap.images):
-            image_name = len(datas)
             name_str = '{0}\x00'.format(image.name)
-            datas.append(DataFileWriter.DataFileData(name_str))
+            image_name = add_data(DataFileWriter.DataFileData(name_str))
             image_data = -1
-            if image.external is False and image.data:
-                image_data = len(datas)
-                datas.append(DataFileWriter.DataFileData(image.data))
+            if image.external is False and (image.source is not None or image.data):
+                image_data = add_data(DataFileWriter.DataFileData.from_source(
+                    image, lambda: image.data))
             items_.append(DataFileWriter.DataFileItem(ITEM_IMAGE, i,
                               pack('6i', 1, image.width, image.height,
                               image.external, image_name, image_data)))
@@ -399,56 +956,53 @@ class DataFileWriter(object):
                     tile_data = -1
                     tele_tile_data = -1
                     speedup_tile_data = -1
-                    tiles_str = ''
+                    version = 3
                     name = string_to_ints(layer.name or 'Tiles', 3)
                     if layer.is_telelayer:
-                        tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(len(layer.tele_tiles.tiles)*'\x00\x00\x00\x00'))
-                        for tile in layer.tele_tiles.tiles:
-                            tiles_str += tile
-                        tele_tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(tiles_str))
+                        tile_data = add_data(DataFileWriter.DataFileData(len(layer.tele_tiles)*'\x00\x00\x00\x00'))
+                        tele_tile_data = add_data(DataFileWriter.DataFileData.from_source(
+                            layer.tele_tiles, layer.tele_tiles._get_tiles))
                         name = string_to_ints('Tele', 3)
                     elif layer.is_speeduplayer:
-                        tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(len(layer.speedup_tiles.tiles)*'\x00\x00\x00\x00'))
-                        for tile in layer.speedup_tiles.tiles:
-                            tiles_str += tile
-                        speedup_tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(tiles_str))
+                        tile_data = add_data(DataFileWriter.DataFileData(len(layer.speedup_tiles)*'\x00\x00\x00\x00'))
+                        speedup_tile_data = add_data(DataFileWriter.DataFileData.from_source(
+                            layer.speedup_tiles, layer.speedup_tiles._get_tiles))
                         name = string_to_ints('Speedup', 3)
                     else:
-                        for tile in layer.tiles.tiles:
-                            tiles_str += tile
-                        tile_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(tiles_str))
+                        if skip_tiles:
+                            version = 4
+                            data = DataFileWriter.DataFileData.from_source(
+                                layer.tiles, lambda: encode_skip_tiles(layer.tiles._get_tiles()),
+                                'skip')
+                        else:
+                            data = DataFileWriter.DataFileData.from_source(
+                                layer.tiles, layer.tiles._get_tiles)
                         if layer.is_gamelayer:
+                            data.unique = True
                             name = string_to_ints('Game', 3)
+                        tile_data = add_data(data)
                     if teemap.telelayer or teemap.speeduplayer:
                         items_.append(DataFileWriter.DataFileItem(ITEM_LAYER, layer_count,
-                               pack('20i', 0, LAYERTYPE_TILES, layer.detail, 3, layer.width,
+                               pack('20i', 0, LAYERTYPE_TILES, layer.detail, version, layer.width,
                                layer.height, layer.game, layer.color[0], layer.color[1],
                                layer.color[2], layer.color[3], layer.color_env,
                                layer.color_env_offset, layer.image_id, tile_data, name[0],
                                name[1], name[2], tele_tile_data, speedup_tile_data)))
                     else:
                         items_.append(DataFileWriter.DataFileItem(ITEM_LAYER, layer_count,
-                               pack('18i', 0, LAYERTYPE_TILES, layer.detail, 3, layer.width,
+                               pack('18i', 0, LAYERTYPE_TILES, layer.detail, version, layer.width,
                                layer.height, layer.game, layer.color[0], layer.color[1],
                                layer.color[2], layer.color[3], layer.color_env,
                                layer.color_env_offset, layer.image_id, tile_data, *name)))
                     layer_count += 1
                 elif layer.type == 'quadlayer':
-                    if len(layer.quads.quads):
-                        quads_str = ''
-                        for quad in layer.quads.quads:
-                            quads_str += quad
-                        quad_data = len(datas)
-                        datas.append(DataFileWriter.DataFileData(quads_str))
+                    if len(layer.quads):
+                        quad_data = add_data(DataFileWriter.DataFileData.from_source(
+                            layer.quads, layer.quads._get_quads))
                         name = string_to_ints(layer.name, 3)
                         items_.append(DataFileWriter.DataFileItem(ITEM_LAYER, layer_count,
                                pack('10i', 7, LAYERTYPE_QUADS, layer.detail, 2,
-                               len(layer.quads.quads), quad_data, layer.image_id, *name)))
+                               len(layer.quads), quad_data, layer.image_id, *name)))
                         layer_count += 1
             name = string_to_ints('Game' if group.is_gamegroup else group.name, 3)
             items_.append(DataFileWriter.DataFileItem(ITEM_GROUP, i,
@@ -471,16 +1025,11 @@ class DataFileWriter(object):
             start_point += num_points
 
         # save points
-        envpoints = []
-        for envpoint in teemap.envpoints:
-            values = 4*[0]
-            for i, value in enumerate(envpoint.values):
-                values[i] = value
-            envpoints.extend([envpoint.time, envpoint.curvetype, values[0],
-                              values[1], values[2], values[3]])
-        fmt = '{0}i'.format(len(envpoints))
+        envpoints = array('i')
+        for envelope in teemap.envelopes:
+            envpoints.extend(envelope.envpoints.get_ints())
         items_.append(DataFileWriter.DataFileItem(ITEM_ENVPOINT, 0,
-               pack(fmt, *envpoints)))
+               envpoints.tostring()))
         items_.sort()
 
         # calculate header
@@ -501,39 +1050,104 @@ class DataFileWriter(object):
                         start = j
             if start > -1:
                 item_types.extend([i, start, num])
-        data_size = 0
-        for data in datas:
-            data_size += data.compressed_size
-        item_types_size = num_item_types*12
-        header_size = 36
-        offset_size = (len(items_) + 2*len(datas)) * 4
-        file_size = header_size + item_types_size + offset_size + item_size + data_size - 16
-        swaplen = file_size - data_size
+        self.num_item_types = num_item_types
+        self.item_types = item_types
+        self.item_size = item_size
 
         # write file
-        with open(map_path, 'wb') as f:
-            f.write('DATA') # file signature
-            header_str = pack('8i', 4, file_size, swaplen, num_item_types,
-                          len(items_), len(datas), item_size, data_size)
-            f.write(header_str)
-            fmt = '{0}i'.format(len(item_types))
-            item_types_str = pack(fmt, *item_types)
-            f.write(item_types_str)
-            item_offset_str = ''
-            offset = 0
-            for item in items_:
-                item_offset_str += pack('i', offset)
-                offset += item.size
-            f.write(item_offset_str)
-            data_offset_str = ''
-            offset = 0
-            for data in datas:
-                data_offset_str += pack('i', offset)
-                offset += data.compressed_size
-            f.write(data_offset_str)
-            for data in datas:
-                f.write(pack('i', data.uncompressed_size))
-            for item in items_:
-                f.write(item.data)
-            for data in datas:
-                f.write(data.data)
+        # a lazily loaded map still reads from its file, it can only be
+        # replaced once the new one is written completely
+        source_path = getattr(teemap, '_source_path', None)
+        replace = (source_path is not None and
+                   not hasattr(map_path, 'write') and
+                   os.path.exists(map_path) and
+                   os.path.samefile(map_path, source_path))
+        with _open_for_writing(map_path, replace) as f:
+            if _is_seekable(f):
+                # the header depends on the compressed sizes, reserve space
+                # for it, so each block can be written right after compressing
+                start = f.tell()
+                f.write(self._get_header_size(items_, datas) * '\x00')
+                for item in items_:
+                    f.write(item.data)
+                compressed_sizes = []
+                for data in self._compress(datas, threads):
+                    f.write(data)
+                    compressed_sizes.append(len(data))
+                end = f.tell()
+                f.seek(start)
+                self._write_header(f, items_, datas, compressed_sizes)
+                f.seek(end)
+            else:
+                compressed = list(self._compress(datas, threads))
+                self._write_header(f, items_, datas, [len(data) for data in compressed])
+                for item in items_:
+                    f.write(item.data)
+                for data in compressed:
+                    f.write(data)
+
+    def _compress(self, datas, threads):
+        """Compresses the data blocks and yields the compressed data in order,
+        each block as soon as it is done.
+
+        Every setting of the compression mode is tried for each block, the
+        compressions run in parallel as zlib releases the GIL. Copied blocks
+        are only compressed again if the mode has multiple settings, the
+        original data is kept if it is still the smallest.
+        """
+        candidates = COMPRESSION_MODES[self.compression]
+        tasks = []
+        for data in datas:
+            if data.compressed is None:
+                if self.compression == 'default':
+                    # the plain compressor
+                    tasks.append((data, None))
+                else:
+                    tasks.extend((data, settings) for settings in candidates)
+            else:
+                tasks.append((data, None))
+                if len(candidates) > 1:
+                    tasks.extend((data, settings) for settings in candidates)
+        results = parallel_imap(lambda task: task[0].compress_data(task[1]),
+                                tasks, threads)
+        # the tasks of a block are next to each other
+        current = smallest = None
+        for (data, settings), result in izip(tasks, results):
+            if data is not current:
+                if current is not None:
+                    yield smallest
+                current, smallest = data, result
+            elif len(result) < len(smallest):
+                smallest = result
+        if current is not None:
+            yield smallest
+
+    def _get_header_size(self, items_, datas):
+        """Returns the size of the header including all offsets."""
+        return 36 + self.num_item_types*12 + (len(items_) + 2*len(datas)) * 4
+
+    def _write_header(self, f, items_, datas, compressed_sizes):
+        """Writes the header, item types, item and data offsets and the
+        uncompressed data sizes."""
+        data_size = sum(compressed_sizes)
+        file_size = self._get_header_size(items_, datas) + self.item_size + \
+                    data_size - 16
+        swaplen = file_size - data_size
+        f.write('DATA') # file signature
+        f.write(pack('8i', 4, file_size, swaplen, self.num_item_types,
+                     len(items_), len(datas), self.item_size, data_size))
+        f.write(pack('{0}i'.format(len(self.item_types)), *self.item_types))
+        item_offsets = []
+        offset = 0
+        for item in items_:
+            item_offsets.append(offset)
+            offset += item.size
+        f.write(pack('{0}i'.format(len(item_offsets)), *item_offsets))
+        data_offsets = []
+        offset = 0
+        for size in compressed_sizes:
+            data_offsets.append(offset)
+            offset += size
+        fmt = '{0}i'.format(len(datas))
+        f.write(pack(fmt, *data_offsets))
+        f.write(pack(fmt, *[data.uncompressed_size for data in datas]))
@@ -9,18 +9,33 @@
     :license: GNU GPL, see LICENSE for more details.
 """
 
+from array import array
+import math
 import os
 import shutil
-from struct import unpack, pack
+from struct import unpack, unpack_from, pack
 import warnings
 from zlib import decompress
 
 import png
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 from constants import ITEM_TYPES, TML_DIR, TILEFLAG_VFLIP, \
-     TILEFLAG_HFLIP, TILEFLAG_OPAQUE, TILEFLAG_ROTATE
+     TILEFLAG_HFLIP, TILEFLAG_OPAQUE, TILEFLAG_ROTATE, CURVETYPE_STEP, \
+     CURVETYPE_SLOW, CURVETYPE_FAST, CURVETYPE_SMOOTH
 from utils import ints_to_string
 
+if numpy is not None:
+    #: NumPy dtypes of the raw tile data, see :meth:`TileLayer.as_array`.
+    TILE_DTYPE = numpy.dtype([('index', 'u1'), ('flags', 'u1'),
+                              ('skip', 'u1'), ('reserved', 'u1')])
+    TELE_TILE_DTYPE = numpy.dtype([('number', 'u1'), ('type', 'u1')])
+    SPEEDUP_TILE_DTYPE = numpy.dtype([('force', 'u1'), ('padding', 'u1'),
+                                      ('angle', '<i2')])
+
 #GAMELAYER_IMAGE = PIL.Image.open(os.path.join(TML_DIR,
 #	os.extsep.join(('entities', 'png'))))
 
@@ -50,6 +65,14 @@ class Image(object):
     The images for a map should be in the list :class:`Teemap.images
     <tml.tml.Teemap>`.
 
+    The png file of an image without data is not checked until
+    :meth:`validate` is called. Embedded image data loaded from a map stays
+    compressed until :attr:`data` is accessed for the first time, and is
+    saved without compressing it again as long as it is not replaced.
+
+    :param data: Raw RGBA data or a lazy reference to it, used internally.
+    :param path: Path to the png file of a non external image without data.
+
     """
 
     # size in ints
@@ -58,23 +81,71 @@ class Image(object):
     def __init__(self, name, width=0, height=0, external=False, data=None,
                  path=''):
         self.name = name
-        self.data = data
+        self._lazy = None
+        self._source = None
+        if hasattr(data, 'load'):
+            self._lazy = data
+            self._source = data
+            self._data = None
+        else:
+            self._data = data
         self.width = width
         self.height = height
         self.external = external
-        if external is True:
+        self.path = path
+
+    @property
+    def data(self):
+        if self._lazy is not None:
+            self._data = self._lazy.load()
+            self._lazy = None
+        return self._data
+
+    @data.setter
+    def data(self, value):
+        self._lazy = None
+        self._source = None
+        self._data = value
+
+    @property
+    def source(self):
+        """Reference to the compressed data loaded from a map or ``None`` if
+        the data was replaced."""
+        return self._source
+
+    @property
+    def modified(self):
+        """``True`` unless the data was loaded from a map and not replaced."""
+        return self._source is None
+
+    @property
+    def png_path(self):
+        """Path to the png file of the image."""
+        if self.external is True:
             png_path = os.sep.join([TML_DIR, 'mapres', self.name])
-            png_path = os.extsep.join([png_path, 'png'])
-        else:
-            png_path = path
+            return os.extsep.join([png_path, 'png'])
+        return self.path
+
+    def validate(self):
+        """Check if the png file of an image without data can be read.
 
-        if data is None:
-            try:
-                png.Reader(png_path).asRGBA()
-            except png.Error:
-                warnings.warn('Image is not in RGBA format')
-            except IOError:
-                warnings.warn('External image "{0}" does not exist'.format(self.name))
+        Decodes the whole png, so it is not done while loading a map.
+        Issues a warning if the image is invalid.
+
+        :returns: ``True`` if the image is valid, otherwise ``False``
+
+        """
+        if self._data is not None or self._lazy is not None:
+            return True
+        try:
+            png.Reader(self.png_path).asRGBA()
+        except png.Error:
+            warnings.warn('Image is not in RGBA format')
+            return False
+        except IOError:
+            warnings.warn('External image "{0}" does not exist'.format(self.name))
+            return False
+        return True
 
     def save(self, dest):
         """Saves the image to the given path.
@@ -111,6 +182,14 @@ class Envelope(object):
     The envelopes for a map should be in the list :class:`Teemap.envelopes
     <tml.tml.Teemap>`.
 
+    The points are kept in an :class:`EnvpointManager`. For loaded maps it
+    is a view of the points in :attr:`Teemap.envpoints <tml.tml.Teemap>`,
+    changing a point of the envelope changes it there, too. When you add or
+    remove points, the envelope gets its own copy of the points. The points
+    of the envelopes are saved, not :attr:`Teemap.envpoints`.
+
+    :param envpoints: List of :class:`envpoints <Envpoint>` or an
+                      :class:`EnvpointManager`.
     """
 
     type_size = 13
@@ -122,6 +201,22 @@ class Envelope(object):
         self.envpoints = envpoints
         self.synced = synced
 
+    @property
+    def envpoints(self):
+        """The :class:`EnvpointManager` with the points of the envelope."""
+        return self._envpoints
+
+    @envpoints.setter
+    def envpoints(self, value):
+        if not isinstance(value, EnvpointManager):
+            value = EnvpointManager(value)
+        self._envpoints = value
+
+    def evaluate(self, times, offset=0, local_times=None):
+        """Returns the values of the envelope at `times` as array with the
+        shape ``(len(times), 4)``. See :meth:`EnvelopeEvaluator.evaluate`."""
+        return EnvelopeEvaluator([self]).evaluate(times, offset, local_times)[0]
+
     def __repr__(self):
         return '<Envelope ({0})>'.format(self.name or len(self.envpoints))
 
@@ -142,6 +237,270 @@ class Envpoint(object):
     def __repr__(self):
         return '<Envpoint ({0})>'.format(self.time)
 
+class EnvpointManager(object):
+    """Handles envpoints in one packed array of 6 ints per point (time,
+    curvetype and four values), the layout of the map file.
+
+    Indexing returns an :class:`EnvpointView`, which reads and writes the
+    array directly. A manager can be a view of a range of the points of
+    another manager, see :meth:`view`. Both share the array until one of
+    them adds or removes points, it then continues with a copy of its
+    points.
+
+    :param points: List of :class:`envpoints <Envpoint>` to put in.
+    :param data: Raw point data as string or array of ints, used internally.
+    """
+
+    #: Number of ints of a point.
+    point_size = 6
+
+    def __init__(self, points=None, data=None):
+        self._points = array('i')
+        self._offset = 0
+        self._count = 0
+        self._shared = False
+        if points:
+            for point in points:
+                self._points.extend(self._point_to_ints(point))
+            self._count = len(points)
+        elif data:
+            if not isinstance(data, array):
+                data = array('i', str(data))
+            if len(data) % self.point_size:
+                raise ValueError('The size of the envpoint data must be a '
+                                 'multiple of {0} ints.'.format(self.point_size))
+            self._points = data
+            self._count = len(data) / self.point_size
+
+    def view(self, start, count):
+        """Returns a manager for `count` points from `start` on, which shares
+        the array with this manager."""
+        if start < 0 or count < 0 or start + count > self._count:
+            raise IndexError('envpoint range out of range')
+        manager = EnvpointManager()
+        manager._points = self._points
+        manager._offset = self._offset + start
+        manager._count = count
+        manager._shared = self._shared = True
+        return manager
+
+    def get_ints(self):
+        """Returns the raw data of the points as array of ints, a copy if the
+        array is shared."""
+        size = self.point_size
+        if not self._shared:
+            return self._points
+        return self._points[self._offset*size:(self._offset+self._count)*size]
+
+    def _detach(self):
+        """Continues with an own copy of the points before their number
+        changes."""
+        if self._shared:
+            self._points = self.get_ints()
+            self._offset = 0
+            self._shared = False
+
+    def _get_offset(self, value):
+        """Returns the offset of the point in the array or raises an
+        IndexError."""
+        if value < 0:
+            value += self._count
+        if not 0 <= value < self._count:
+            raise IndexError('envpoint index out of range')
+        return (self._offset + value) * self.point_size
+
+    def __getitem__(self, value):
+        if isinstance(value, slice):
+            data = array('i')
+            for i in xrange(*value.indices(self._count)):
+                offset = self._get_offset(i)
+                data.extend(self._points[offset:offset+self.point_size])
+            return EnvpointManager(data=data)
+        return EnvpointView(self, self._get_offset(value))
+
+    def __setitem__(self, k, v):
+        offset = self._get_offset(k)
+        self._points[offset:offset+self.point_size] = \
+            array('i', self._point_to_ints(v))
+
+    def __iter__(self):
+        for i in xrange(self._count):
+            yield self[i]
+
+    def __len__(self):
+        return self._count
+
+    def insert(self, index, value):
+        self._detach()
+        index = max(0, min(self._count, index if index >= 0 else
+                           index + self._count))
+        offset = index * self.point_size
+        self._points[offset:offset] = array('i', self._point_to_ints(value))
+        self._count += 1
+
+    def append(self, value):
+        self.insert(self._count, value)
+
+    def pop(self, value=-1):
+        point = self[value].copy()
+        self._detach()
+        offset = self._get_offset(value)
+        del self._points[offset:offset+self.point_size]
+        self._count -= 1
+        return point
+
+    def _point_to_ints(self, point):
+        values = (list(point.values) + [0] * 4)[:4]
+        return [point.time or 0, point.curvetype or 0] + values
+
+    def __repr__(self):
+        return '<EnvpointManager ({0})>'.format(len(self))
+
+def _envpoint_field(pos, doc):
+    """Returns a property for the int at `pos` of an :class:`EnvpointView`."""
+    def getter(self):
+        return self._manager._points[self._offset+pos]
+    def setter(self, value):
+        self._manager._points[self._offset+pos] = value
+    return property(getter, setter, doc=doc)
+
+class EnvpointView(Envpoint):
+    """An :class:`Envpoint` bound to the data of an :class:`EnvpointManager`.
+
+    The attributes are read from and written to the array of the manager.
+    :attr:`values` is returned as a new list, assign it to change the values.
+
+    :param manager: The manager of the point.
+    :param offset: Position of the point in the array of the manager.
+    """
+
+    __slots__ = ('_manager', '_offset')
+
+    time = _envpoint_field(0, 'Time of the point in milliseconds.')
+    curvetype = _envpoint_field(1, 'Curve to the next point.')
+
+    def __init__(self, manager, offset):
+        self._manager = manager
+        self._offset = offset
+
+    @property
+    def values(self):
+        """The four values of the point."""
+        return self._manager._points[self._offset+2:self._offset+6].tolist()
+
+    @values.setter
+    def values(self, value):
+        values = (list(value) + [0] * 4)[:4]
+        self._manager._points[self._offset+2:self._offset+6] = array('i', values)
+
+    def copy(self):
+        """Returns an :class:`Envpoint` with the current values, which is not
+        bound to the manager."""
+        return Envpoint(time=self.time, curvetype=self.curvetype,
+                        values=self.values)
+
+class EnvelopeEvaluator(object):
+    """Samples envelopes like the client does, for many envelopes and
+    timestamps at once. Requires NumPy.
+
+    The points of all envelopes are packed into flat arrays once, so keep
+    the evaluator as long as the envelopes do not change.
+
+    >>> evaluator = EnvelopeEvaluator(teemap.envelopes)
+    >>> values = evaluator.evaluate(numpy.arange(0, 10000, 20))
+
+    :param envelopes: List of :class:`envelopes <Envelope>`.
+    """
+
+    def __init__(self, envelopes):
+        if numpy is None:
+            raise ImportError('NumPy is required to evaluate envelopes')
+        data = array('i')
+        for envelope in envelopes:
+            data.extend(envelope.envpoints.get_ints())
+        points = numpy.frombuffer(data, numpy.int32).reshape(-1, 6)
+        self.counts = numpy.array([len(envelope.envpoints)
+                                   for envelope in envelopes], numpy.int64)
+        self.starts = numpy.cumsum(self.counts) - self.counts
+        self.synced = numpy.array([bool(envelope.synced)
+                                   for envelope in envelopes], bool)
+        self.times = points[:, 0].astype(numpy.float64)
+        self.curvetypes = points[:, 1].copy()
+        # values are fixed point numbers with 10 bits for the fraction
+        self.values = points[:, 2:] / 1024.0
+
+    def evaluate(self, times, offsets=0, local_times=None):
+        """Returns the values of the envelopes at `times`.
+
+        The client plays synced envelopes with the game time since the
+        start of the round and the other envelopes with its local time.
+        Pass `local_times` to sample those with a different clock, by
+        default both clocks are the same.
+
+        :param times: Timestamps in milliseconds.
+        :param offsets: Time offset in milliseconds added to the clock, like
+                        the ``pos_env_offset`` of a quad, for all envelopes
+                        or one per envelope.
+        :param local_times: Timestamps used for envelopes which are not
+                            synced.
+        :returns: Array with the shape ``(len(envelopes), len(times), 4)``,
+                  all four channels are returned regardless of
+                  :attr:`Envelope.channels`.
+        """
+        times = numpy.asarray(times, numpy.float64).reshape(-1)
+        if local_times is None:
+            local_times = times
+        local_times = numpy.asarray(local_times, numpy.float64).reshape(-1)
+        offsets = numpy.asarray(offsets, numpy.float64).reshape(-1, 1)
+        result = numpy.zeros((len(self.counts), len(times), 4))
+        if not len(self.times):
+            return result
+        clock = numpy.where(self.synced[:, None], times, local_times) + offsets
+
+        # outside of the envelope the client uses the last point
+        first = numpy.minimum(self.starts, len(self.times) - 1)
+        last = numpy.maximum(self.starts + self.counts - 1, 0)
+        has_points = self.counts > 0
+        result[has_points] = self.values[last[has_points], None]
+
+        duration = numpy.where(self.counts > 1, self.times[last], 0)[:, None]
+        looping = duration > 0
+        clock = numpy.fmod(clock, numpy.where(looping, duration, 1))
+        valid = looping & (clock >= self.times[first][:, None]) & \
+                (clock <= duration)
+        envelope_ids, time_ids = numpy.nonzero(valid)
+        clock = clock[valid]
+
+        # binary search over the times of all points at once, the envelope
+        # number is added as offset to keep the keys sorted
+        span = self.times.max() - self.times.min() + 1
+        point_ids = numpy.repeat(numpy.arange(len(self.counts)), self.counts)
+        keys = point_ids * span + (self.times - self.times.min())
+        point = numpy.searchsorted(keys, envelope_ids * span +
+                                   (clock - self.times.min())) - 1
+        start = self.starts[envelope_ids]
+        point = numpy.clip(point, start, start + self.counts[envelope_ids] - 2)
+
+        delta = self.times[point + 1] - self.times[point]
+        a = numpy.where(delta > 0, (clock - self.times[point]) /
+                        numpy.where(delta > 0, delta, 1), 0)
+        curvetype = self.curvetypes[point]
+        a = numpy.select([curvetype == CURVETYPE_STEP,
+                          curvetype == CURVETYPE_SLOW,
+                          curvetype == CURVETYPE_FAST,
+                          curvetype == CURVETYPE_SMOOTH],
+                         [0, a**3, 1 - (1 - a)**3, -2*a**3 + 3*a**2], a)
+        values = self.values[point]
+        result[envelope_ids, time_ids] = values + \
+            (self.values[point + 1] - values) * a[:, None]
+        return result
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __repr__(self):
+        return '<EnvelopeEvaluator ({0})>'.format(len(self))
+
 class Group(object):
     """Represents a group.
 
@@ -186,6 +545,16 @@ class Group(object):
     def __repr__(self):
         return '<Group ({0})>'.format(len(self.layers))
 
+def _copy_tiles(src, src_width, src_x, src_y, dest, dest_width, dest_x,
+                dest_y, w, h, tile_size=4):
+    """Copies a `w` x `h` area of tiles row by row between two tile buffers.
+    The area must be inside of both buffers."""
+    length = w * tile_size
+    for row in xrange(h):
+        src_start = ((src_y+row)*src_width+src_x) * tile_size
+        dest_start = ((dest_y+row)*dest_width+dest_x) * tile_size
+        dest[dest_start:dest_start+length] = src[src_start:src_start+length]
+
 class Layer(object):
     """Represents the layer data every layer has.
 
@@ -281,17 +650,170 @@ class TileLayer(Layer):
         self._check_bounds(x, y)
         self.tiles[y*self.width+x] = tile
 
+    def _as_array(self, manager, dtype):
+        if numpy is None:
+            raise ImportError('NumPy is required for array views')
+        if manager is None:
+            raise ValueError('The layer has no such tiles')
+        if len(manager) != self.width * self.height:
+            raise ValueError('The number of tiles does not match the size')
+        array = numpy.frombuffer(manager.tiles, dtype)
+        return array.reshape(self.height, self.width)
+
+    def as_array(self):
+        """Returns a NumPy view of the tiles.
+
+        The structured array has the shape ``(height, width)`` and the fields
+        ``index``, ``flags``, ``skip`` and ``reserved``. It shares the memory
+        with the layer, so writing to it changes the tiles. The view becomes
+        invalid when the size of the layer changes. Requires NumPy.
+
+        >>> tiles = layer.as_array()
+        >>> (tiles['index'] == TILEINDEX['solid']).sum()
+        >>> tiles['index'][0, :] = TILEINDEX['solid']
+
+        """
+        return self._as_array(self.tiles, TILE_DTYPE)
+
+    def as_tele_array(self):
+        """Like :meth:`as_array` for the tele tiles, with the fields
+        ``number`` and ``type``."""
+        return self._as_array(self.tele_tiles, TELE_TILE_DTYPE)
+
+    def as_speedup_array(self):
+        """Like :meth:`as_array` for the speedup tiles, with the fields
+        ``force``, ``padding`` and ``angle``."""
+        return self._as_array(self.speedup_tiles, SPEEDUP_TILE_DTYPE)
+
+    def _clip(self, x, y, w, h):
+        """Clips the area to the layer, the size can become 0."""
+        if w is None:
+            w = self.width - x
+        if h is None:
+            h = self.height - y
+        x2 = max(0, min(x + w, self.width))
+        y2 = max(0, min(y + h, self.height))
+        x = max(0, min(x, self.width))
+        y = max(0, min(y, self.height))
+        return x, y, max(0, x2 - x), max(0, y2 - y)
+
+    def _iter_rows(self, x, y, w, h):
+        """Yields start and end of the tile data of each row of the area."""
+        x, y, w, h = self._clip(x, y, w, h)
+        for _y in xrange(y, y+h):
+            start = (_y*self.width+x) * 4
+            yield start, start + w*4
+
+    def fill(self, x, y, w, h, tile):
+        """Sets all tiles of the area to `tile`.
+
+        The area is clipped to the layer.
+
+        :param tile: :class:`Tile` or its 4 byte string.
+
+        """
+        tile_size = self.tiles.tile_size
+        if not isinstance(tile, str):
+            tile = self.tiles._tile_to_string(tile)
+        elif len(tile) != tile_size:
+            raise ValueError('The string must be exactly {0} chars '
+                             'long.'.format(tile_size))
+        tiles = self.tiles.tiles
+        for start, end in self._iter_rows(x, y, w, h):
+            tiles[start:end] = tile * ((end - start) / tile_size)
+
+    def replace(self, old_index, new_index):
+        """Changes the index of all tiles with `old_index` to `new_index`.
+
+        :returns: Number of changed tiles
+
+        """
+        indices = self.tiles._get_tiles()[::4]
+        count = indices.count(chr(old_index))
+        if count and old_index != new_index:
+            table = bytearray(xrange(256))
+            table[old_index] = new_index
+            self.tiles.tiles[::4] = indices.translate(str(table))
+        return count
+
+    def _change_flags(self, table, x, y, w, h):
+        tiles = self.tiles.tiles
+        for start, end in self._iter_rows(x, y, w, h):
+            tiles[start+1:end:4] = tiles[start+1:end:4].translate(table)
+
+    def set_flags(self, flags, x=0, y=0, w=None, h=None):
+        """Sets the `flags` (e.g. :data:`TILEFLAG_HFLIP
+        <tml.constants.TILEFLAG_HFLIP>`) on all tiles of the area, by
+        default on the whole layer."""
+        table = ''.join([chr(i | flags) for i in xrange(256)])
+        self._change_flags(table, x, y, w, h)
+
+    def clear_flags(self, flags, x=0, y=0, w=None, h=None):
+        """Removes the `flags` from all tiles of the area, by default from the
+        whole layer."""
+        table = ''.join([chr(i & ~flags & 0xff) for i in xrange(256)])
+        self._change_flags(table, x, y, w, h)
+
+    def histogram(self):
+        """Counts the tiles by index.
+
+        :returns: Dictionary mapping each index in the layer to its count
+
+        """
+        indices = str(self.tiles._get_tiles()[::4])
+        return dict((ord(char), indices.count(char)) for char in set(indices))
+
+    def find(self, predicate):
+        """Finds the tiles matching the `predicate`.
+
+        :param predicate: A tile index, a collection of indices or a callable
+                          which gets passed an index and returns if it
+                          matches.
+        :returns: List of the ``(x, y)`` coordinates of the matching tiles
+
+        """
+        if isinstance(predicate, (int, long)):
+            matches = [predicate]
+        elif callable(predicate):
+            matches = [i for i in xrange(256) if predicate(i)]
+        else:
+            matches = list(predicate)
+        table = bytearray(256)
+        for index in matches:
+            table[index] = 1
+        mask = self.tiles._get_tiles()[::4].translate(str(table))
+        coords = []
+        pos = mask.find('\x01')
+        while pos != -1:
+            coords.append((pos % self.width, pos / self.width))
+            pos = mask.find('\x01', pos + 1)
+        return coords
+
+    def _iter_managers(self, other=None):
+        """Yields the names of the tile managers of the layer, with `other`
+        only those both layers have."""
+        for name in ('tiles', 'tele_tiles', 'speedup_tiles'):
+            if getattr(self, name) is None:
+                continue
+            if other is not None and getattr(other, name) is None:
+                continue
+            yield name
+
     def select(self, x, y, w=1, h=1):
         """Select an area of the tilelayer.
 
         Creates a new TileLayer of the section you are selecting. If you are
         selecting over the borders, it will just cut your selection to fit to
-        the layer.
+        the layer. The selection contains at least one tile.
 
         :returns: TileLayer
 
         """
 
+        if x < 0:
+            w += x
+        if y < 0:
+            h += y
         x = max(0, min(x, self.width-1))
         y = max(0, min(y, self.height-1))
         w = max(1, min(w, self.width-x))
@@ -300,41 +822,62 @@ class TileLayer(Layer):
                           color_env=self.color_env,
                           color_env_offset=self.color_env_offset,
                           image_id=self.image_id)
-        data = []
-        for _y in range(h):
-            for _x in range(w):
-                data.append(self.tiles.tiles[(y+_y)*self.width+(x+_x)])
-        layer.tiles = TileManager(data=data)
-        if self.tele_tiles and len(self.tele_tiles.tiles) == len(self.tiles.tiles):
-            for _y in range(h):
-                for _x in range(w):
-                    data.append(self.tele_tiles.tiles[(y+_y)*self.width+(x+_x)])
-        layer.tele_tiles = TileManager(data=data)
-        if self.speedup_tiles and len(self.speedup_tiles.tiles) == len(self.tiles.tiles):
-            for _y in range(h):
-                for _x in range(w):
-                    data.append(self.speedup_tiles.tiles[(y+_y)*self.width+(x+_x)])
-        layer.speedup_tiles = TileManager(data=data)
+        for name in self._iter_managers():
+            manager = getattr(self, name)
+            if len(manager) != len(self.tiles):
+                continue
+            selection = TileManager(w * h, _type=manager.type)
+            _copy_tiles(manager._get_tiles(), self.width, x, y,
+                        selection.tiles, w, 0, 0, w, h, manager.tile_size)
+            setattr(layer, name, selection)
         return layer
 
     def draw(self, x, y, tilelayer):
         """Draws the the passed tilelayer onto itself.
 
-        If the given tilelayer is too big, it will be cut and the rest
-        discarded.
+        The tilelayer is placed with its upper left corner at `x`, `y`, the
+        coordinates can be negative. The parts outside of the layer are
+        cut off and discarded. Tele and speedup tiles are drawn as well if
+        both layers have them.
 
         """
 
-        x = max(0, min(x, self.width-1))
-        y = max(0, min(y, self.height-1))
-
-        for _y in range(tilelayer.height):
-            for _x in range(tilelayer.width):
-                tile = tilelayer.tiles[_y*tilelayer.width+_x]
-                try:
-                    self.tiles[(y+_y)*self.width+(x+_x)] = tile
-                except IndexError:
-                    pass
+        # clip the source to the edges of the layer
+        src_x = max(0, -x)
+        src_y = max(0, -y)
+        x = max(0, x)
+        y = max(0, y)
+        w = min(tilelayer.width - src_x, self.width - x)
+        h = min(tilelayer.height - src_y, self.height - y)
+        if w <= 0 or h <= 0:
+            return
+        for name in self._iter_managers(tilelayer):
+            src = getattr(tilelayer, name)
+            dest = getattr(self, name)
+            if src.type != dest.type or \
+               len(src) != tilelayer.width * tilelayer.height:
+                continue
+            _copy_tiles(src._get_tiles(), tilelayer.width, src_x, src_y,
+                        dest.tiles, self.width, x, y, w, h, dest.tile_size)
+
+    def _resize(self, width, height):
+        """Changes the size of all tile managers, the tiles are kept at their
+        position and new tiles are empty."""
+        if width < 0 or height < 0:
+            raise ValueError('Value must be positive')
+        size = len(self.tiles)
+        for name in self._iter_managers():
+            manager = getattr(self, name)
+            if len(manager) != size:
+                continue
+            resized = TileManager(width * height, _type=manager.type)
+            _copy_tiles(manager._get_tiles(), self._width, 0, 0,
+                        resized.tiles, width, 0, 0,
+                        min(width, self._width), min(height, self._height),
+                        manager.tile_size)
+            setattr(self, name, resized)
+        self._width = width
+        self._height = height
 
     @property
     def width(self):
@@ -342,19 +885,10 @@ class TileLayer(Layer):
 
     @width.setter
     def width(self, value):
-        if value < 0:
+        if value != self._width:
+            self._resize(value, self._height)
+        elif value < 0:
             raise ValueError('Value must be positive')
-        if value < self._width:
-            tiles = self.select(0, 0, value, self.height).tiles
-        elif value > self._width:
-            layer = TileLayer(value, self.height)
-            layer.draw(0, 0, self)
-            tiles = layer.tiles
-        else:
-            return
-
-        self._width = value
-        self.tiles = tiles
 
     @property
     def height(self):
@@ -362,19 +896,10 @@ class TileLayer(Layer):
 
     @height.setter
     def height(self, value):
-        if value < 0:
+        if value != self._height:
+            self._resize(self._width, value)
+        elif value < 0:
             raise ValueError('Value must be positive')
-        if value < self._height:
-            tiles = self.select(0, 0, self.width, value).tiles
-        elif value > self._height:
-            layer = TileLayer(self.width, value)
-            layer.draw(0, 0, self)
-            tiles = layer.tiles
-        else:
-            return
-
-        self._height = value
-        self.tiles = tiles
 
     @property
     def is_gamelayer(self):
@@ -418,13 +943,137 @@ class QuadLayer(Layer):
         self.quads = quads or QuadManager()
         self.type = 'quadlayer'
 
+    def quads_in(self, x, y, width, height):
+        """Returns the indices of the quads whose bounding box intersects the
+        rectangle, in quad coordinates (see :class:`QuadIndex`)."""
+        return self.quads.query(x, y, x + width, y + height)
+
+    def quads_at(self, x, y):
+        """Returns the indices of the quads whose bounding box contains the
+        point."""
+        return self.quads.query(x, y, x, y)
+
     def __repr__(self):
         return '<Quadlayer ({0})>'.format(len(self.quads))
 
+class QuadIndex(object):
+    """Uniform grid of the bounding boxes of quads, used to find the quads in
+    a rectangle without looking at every quad.
+
+    Bounding boxes are given as ``(x0, y0, x1, y1)`` in the coordinates of
+    the quad points, the four corners of a quad, not its pivot. Each box is
+    stored in every grid cell it touches, boxes covering more than
+    :attr:`max_cells` cells are kept in a separate list which is checked on
+    every query.
+
+    :param boxes: List of bounding boxes, the position is the quad index.
+    :param cell_size: Width and height of a cell, the mean size of the boxes
+                      by default.
+    """
+
+    #: Maximum number of cells a box is stored in.
+    max_cells = 64
+
+    def __init__(self, boxes=None, cell_size=None):
+        self.boxes = []
+        self._cells = {}
+        self._large = set()
+        boxes = boxes or []
+        if cell_size is None:
+            sizes = [max(x1 - x0, y1 - y0) for x0, y0, x1, y1 in boxes]
+            cell_size = sum(sizes) / len(sizes) if sizes else 1024
+        self.cell_size = max(1, int(cell_size))
+        for box in boxes:
+            self.insert(len(self.boxes), box)
+
+    def _get_cells(self, box):
+        """Returns the range of cells touched by `box`."""
+        x0, y0, x1, y1 = [value // self.cell_size for value in box]
+        return x0, y0, x1, y1
+
+    def _add(self, index, box):
+        x0, y0, x1, y1 = self._get_cells(box)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            self._large.add(index)
+            return
+        for cy in xrange(y0, y1 + 1):
+            for cx in xrange(x0, x1 + 1):
+                self._cells.setdefault((cx, cy), set()).add(index)
+
+    def _discard(self, index):
+        box = self.boxes[index]
+        if index in self._large:
+            self._large.remove(index)
+            return
+        x0, y0, x1, y1 = self._get_cells(box)
+        for cy in xrange(y0, y1 + 1):
+            for cx in xrange(x0, x1 + 1):
+                cell = self._cells[cx, cy]
+                cell.discard(index)
+                if not cell:
+                    del self._cells[cx, cy]
+
+    def insert(self, index, box):
+        """Adds the box of a new quad. Only appending at the end is cheap,
+        the following quads are renumbered otherwise."""
+        if index < len(self.boxes):
+            self._renumber(index, 1)
+        self.boxes.insert(index, tuple(box))
+        self._add(index, box)
+
+    def update(self, index, box):
+        """Replaces the box of the quad at `index`."""
+        self._discard(index)
+        self.boxes[index] = tuple(box)
+        self._add(index, box)
+
+    def remove(self, index):
+        """Removes the box of the quad at `index` and renumbers the following
+        quads."""
+        self._discard(index)
+        del self.boxes[index]
+        if index < len(self.boxes):
+            self._renumber(index, -1)
+
+    def _renumber(self, start, offset):
+        """Adds `offset` to all indices from `start` on."""
+        def shift(indices):
+            return set(i + offset if i >= start else i for i in indices)
+        for key, cell in self._cells.iteritems():
+            self._cells[key] = shift(cell)
+        self._large = shift(self._large)
+
+    def query(self, x0, y0, x1, y1):
+        """Returns the sorted indices of the boxes intersecting the rectangle
+        from ``(x0, y0)`` to ``(x1, y1)``, both inclusive."""
+        cx0, cy0, cx1, cy1 = self._get_cells((x0, y0, x1, y1))
+        candidates = set(self._large)
+        if (cx1 - cx0 + 1) * (cy1 - cy0 + 1) > len(self._cells):
+            cells = self._cells.itervalues()
+        else:
+            cells = (self._cells.get((cx, cy)) for cy in xrange(cy0, cy1 + 1)
+                     for cx in xrange(cx0, cx1 + 1))
+        for cell in cells:
+            if cell:
+                candidates.update(cell)
+        boxes = self.boxes
+        return sorted(i for i in candidates if boxes[i][0] <= x1 and
+                      boxes[i][2] >= x0 and boxes[i][1] <= y1 and
+                      boxes[i][3] >= y0)
+
+    def __len__(self):
+        return len(self.boxes)
+
+    def __repr__(self):
+        return '<QuadIndex ({0})>'.format(len(self))
+
 class QuadManager(object):
     """Handles quads while sparing memory.
 
-    Keeps track of quads as simple strings, but returns a Quad class on demand.
+    Keeps track of all quads in one packed array of 38 ints per quad,
+    exactly as they are stored in a map file, but returns a Quad class on
+    demand. The transformations like :meth:`translate` work on the whole
+    array at once and require NumPy.
 
     .. note::
 
@@ -432,46 +1081,183 @@ class QuadManager(object):
         need to assign new quad explicity. This will not work like you would
         expect:
 
-        >>> layer.quads[10].rotate('l')
+        >>> layer.quads[10].pos_env = 1
 
         Instead, you need to re-assign the quad:
 
         >>> quad = layer.quads[10]
-        >>> quad.rotate('l')
+        >>> quad.pos_env = 1
         >>> layer.quads[10] = quad
 
         We are searching for a better solution, in the meanwhile, use this
         workaround
 
+    Quads loaded from a map are saved without compressing them again until
+    they are modified. Accessing :attr:`quads` counts as a modification,
+    because the array could be changed in place.
+
+    :meth:`query` uses a :class:`QuadIndex`, which is built on the first
+    query and kept up to date by :meth:`__setitem__`, :meth:`append` and
+    :meth:`pop`. Any other change, including accessing :attr:`quads`,
+    discards it.
+
     :param quads: List of quads to put in.
-    :param data: Raw quad data, used internally.
+    :param data: Raw quad data as string, array or list of quad strings, or
+                 a lazy reference to it, used internally.
+    :param source: Reference to the compressed quad data, used internally.
     """
 
-    def __init__(self, quads=None, data=None):
-        self.quads = []
+    #: Number of ints of a quad.
+    quad_size = 38
+
+    def __init__(self, quads=None, data=None, source=None):
+        self._lazy = None
+        self._index = None
+        self._exported = False
+        self.quads = array('i')
         if quads:
-            self.quads = [self._quad_to_string(quad) for quad in quads]
+            for quad in quads:
+                self._quads.extend(self._quad_to_ints(quad))
+        elif hasattr(data, 'load'):
+            self._lazy = data
         elif data:
-            self.quads.extend(data)
+            self.quads = data
+        self._source = source
+
+    def load(self):
+        """Decompresses lazily loaded quads right now."""
+        if self._lazy is not None:
+            self._quads = array('i', self._lazy.load())
+            self._lazy = None
+
+    def _get_quads(self):
+        """Returns the array of quads without marking it as modified."""
+        self.load()
+        return self._quads
+
+    def _change(self):
+        """Returns the array of quads and marks it as modified, but keeps the
+        index."""
+        self._source = None
+        return self._get_quads()
+
+    def _resize(self):
+        """Returns the array of quads for a change of its size.
+
+        The array module does not prevent resizing an array while NumPy views
+        of it exist, the views would point to freed memory. Once a view was
+        returned by :meth:`as_array`, the manager continues with a copy, the
+        old array stays alive as long as the views use it.
+        """
+        quads = self._change()
+        if self._exported:
+            quads = self._quads = quads[:]
+            self._exported = False
+        return quads
+
+    @property
+    def quads(self):
+        """The raw quad data as flat array of ints."""
+        self._index = None
+        return self._resize()
+
+    @quads.setter
+    def quads(self, value):
+        if isinstance(value, list):
+            value = ''.join(value)
+        if not isinstance(value, array):
+            value = array('i', str(value))
+        if len(value) % self.quad_size:
+            raise ValueError('The size of the quad data must be a multiple '
+                             'of {0} ints.'.format(self.quad_size))
+        self._lazy = None
+        self._source = None
+        self._index = None
+        self._exported = False
+        self._quads = value
+
+    @property
+    def source(self):
+        """Reference to the compressed data loaded from a map or ``None`` if
+        the quads were modified."""
+        return self._source
+
+    @property
+    def modified(self):
+        """``True`` unless the quads were loaded from a map and not modified."""
+        return self._source is None
+
+    def _get_offset(self, value):
+        """Returns the offset of the quad or raises an IndexError."""
+        length = len(self)
+        if value < 0:
+            value += length
+        if not 0 <= value < length:
+            raise IndexError('quad index out of range')
+        return value * self.quad_size
 
     def __getitem__(self, value):
+        quads = self._get_quads()
+        size = self.quad_size
         if isinstance(value, slice):
-            return QuadManager(self.quads[value])
-        return self._string_to_quad(self.quads[value])
+            start, stop, step = value.indices(len(self))
+            if step == 1:
+                return QuadManager(data=quads[start*size:max(start, stop)*size])
+            data = array('i')
+            for i in xrange(start, stop, step):
+                data.extend(quads[i*size:(i+1)*size])
+            return QuadManager(data=data)
+        offset = self._get_offset(value)
+        return self._ints_to_quad(quads[offset:offset+size])
 
     def __setitem__(self, k, v):
-        self.quads[k] = self._quad_to_string(v)
+        offset = self._get_offset(k)
+        data = array('i', self._quad_to_ints(v))
+        self._change()[offset:offset+self.quad_size] = data
+        if self._index is not None:
+            self._index.update(offset / self.quad_size, self._get_box(data))
 
     def __len__(self):
-        return len(self.quads)
+        if self._lazy is not None:
+            return len(self._lazy) / (self.quad_size * 4)
+        return len(self._get_quads()) / self.quad_size
 
     def pop(self, value):
-        return self._string_to_quad(self.quads.pop(value))
+        offset = self._get_offset(value)
+        quads = self._resize()
+        quad = self._ints_to_quad(quads[offset:offset+self.quad_size])
+        del quads[offset:offset+self.quad_size]
+        if self._index is not None:
+            self._index.remove(offset / self.quad_size)
+        return quad
 
     def append(self, value):
-        self.quads.append(self._quad_to_string(value))
-
-    def _quad_to_string(self, quad):
+        data = self._quad_to_ints(value)
+        self._resize().extend(data)
+        if self._index is not None:
+            self._index.insert(len(self._index), self._get_box(data))
+
+    def _get_box(self, data, offset=0):
+        """Returns the bounding box of the corners of the quad at `offset`."""
+        xs = data[offset:offset+8:2]
+        ys = data[offset+1:offset+8:2]
+        return min(xs), min(ys), max(xs), max(ys)
+
+    def get_index(self):
+        """Returns the :class:`QuadIndex` of the quads, building it if
+        necessary."""
+        if self._index is None:
+            quads = self._get_quads()
+            self._index = QuadIndex([self._get_box(quads, offset) for offset
+                                     in xrange(0, len(quads), self.quad_size)])
+        return self._index
+
+    def query(self, x0, y0, x1, y1):
+        """Returns the sorted indices of the quads whose bounding box
+        intersects the rectangle from ``(x0, y0)`` to ``(x1, y1)``."""
+        return self.get_index().query(x0, y0, x1, y1)
+
+    def _quad_to_ints(self, quad):
         data = []
         for point in quad.points:
             data.extend(point)
@@ -481,25 +1267,125 @@ class QuadManager(object):
             data.extend(texcoord)
         data.extend([quad.pos_env, quad.pos_env_offset, quad.color_env,
                      quad.color_env_offset])
-        return pack('38i', *data)
-
-    def _string_to_quad(self, string):
-        quad_data = string
-        points = []
-        for l in range(5):
-            points.append(unpack('2i', quad_data[l*8:l*8+8]))
-        colors = []
-        for l in range(4):
-            colors.append(unpack('4i', quad_data[40+l*16:40+l*16+16]))
-        texcoords = []
-        for l in range(4):
-            texcoords.append(unpack('2i', quad_data[104+l*8:104+l*8+8]))
-        pos_env, pos_env_offset, color_env, color_env_offset = unpack('4i',
-                                                            quad_data[136:152])
+        return data
+
+    def _ints_to_quad(self, data):
+        points = [tuple(data[i:i+2]) for i in xrange(0, 10, 2)]
+        colors = [tuple(data[i:i+4]) for i in xrange(10, 26, 4)]
+        texcoords = [tuple(data[i:i+2]) for i in xrange(26, 34, 2)]
+        pos_env, pos_env_offset, color_env, color_env_offset = data[34:38]
         return Quad(pos_env=pos_env, pos_env_offset=pos_env_offset,
                     color_env=color_env, color_env_offset=color_env_offset,
                     points=points, colors=colors, texcoords=texcoords)
 
+    def as_array(self):
+        """Returns a NumPy view of the quads.
+
+        The int32 array has the shape ``(n, 38)``, one row per quad in the
+        layout of the map file: the x and y of the four corners and the pivot
+        (columns 0-9), the four colors (10-25), the texture coordinates
+        (26-33), ``pos_env``, ``pos_env_offset``, ``color_env`` and
+        ``color_env_offset``. It shares the memory with the manager, so
+        writing to it changes the quads. Like accessing :attr:`quads` it
+        counts as a modification. After quads are added or removed, the view
+        is detached and keeps the old quads. Requires NumPy.
+
+        >>> quads = layer.quads.as_array()
+        >>> quads[:, 34] = -1 # remove all position envelopes
+
+        """
+        quads = self._view()
+        self._exported = True
+        return quads
+
+    def _view(self):
+        """Returns a NumPy view for internal use, which must not be kept."""
+        if numpy is None:
+            raise ImportError('NumPy is required for array views')
+        self._index = None
+        return numpy.frombuffer(self._change(), numpy.int32).reshape(-1, self.quad_size)
+
+    def _get_rows(self, quads, indices):
+        """Returns a slice or an array of rows for `indices`, see
+        :meth:`translate`."""
+        if indices is None:
+            return slice(None)
+        if isinstance(indices, slice):
+            return indices
+        return numpy.atleast_1d(numpy.arange(len(quads))[indices])
+
+    def translate(self, x, y, indices=None):
+        """Moves the quads, the offsets are rounded to integers.
+
+        :param indices: Index, slice, list of indices or boolean mask of the
+                        quads to change. All quads by default.
+        """
+        quads = self._view()
+        indices = self._get_rows(quads, indices)
+        quads[indices, 0:10:2] += int(numpy.rint(x))
+        quads[indices, 1:10:2] += int(numpy.rint(y))
+
+    def _transform(self, matrix, indices):
+        """Applies the 2x2 `matrix` to the corners of the quads relative to
+        their pivot."""
+        quads = self._view()
+        indices = self._get_rows(quads, indices)
+        selection = quads[indices].astype(numpy.float64)
+        pivot_x = selection[:, 8:9]
+        pivot_y = selection[:, 9:10]
+        x = selection[:, 0:8:2] - pivot_x
+        y = selection[:, 1:8:2] - pivot_y
+        quads[indices, 0:8:2] = numpy.rint(pivot_x + matrix[0][0]*x + matrix[0][1]*y)
+        quads[indices, 1:8:2] = numpy.rint(pivot_y + matrix[1][0]*x + matrix[1][1]*y)
+
+    def scale(self, factor_x, factor_y=None, indices=None):
+        """Scales the quads around their pivot.
+
+        :param factor_y: Vertical factor, the same as `factor_x` by default.
+        :param indices: See :meth:`translate`.
+        """
+        if factor_y is None:
+            factor_y = factor_x
+        self._transform(((factor_x, 0), (0, factor_y)), indices)
+
+    def rotate(self, angle, indices=None):
+        """Rotates the quads around their pivot.
+
+        :param angle: Angle in degrees, clockwise on the screen.
+        :param indices: See :meth:`translate`.
+        """
+        angle = math.radians(angle)
+        cos, sin = math.cos(angle), math.sin(angle)
+        self._transform(((cos, -sin), (sin, cos)), indices)
+
+    def recolor(self, color, indices=None):
+        """Sets the colors of the quads.
+
+        :param color: ``(r, g, b, a)`` for all corners or a list of four such
+                      tuples, one for each corner.
+        :param indices: See :meth:`translate`.
+        """
+        quads = self._view()
+        indices = self._get_rows(quads, indices)
+        color = numpy.asarray(color, numpy.int32).reshape(-1)
+        if len(color) == 4:
+            color = numpy.tile(color, 4)
+        quads[indices, 10:26] = color
+
+    def remap_texcoords(self, scale=(1, 1), offset=(0, 0), indices=None):
+        """Changes the texture coordinates to ``texcoord * scale + offset``.
+
+        :param scale: ``(x, y)`` factors
+        :param offset: ``(x, y)`` offset added after scaling
+        :param indices: See :meth:`translate`.
+        """
+        quads = self._view()
+        indices = self._get_rows(quads, indices)
+        for axis in (0, 1):
+            columns = slice(26 + axis, 34, 2)
+            quads[indices, columns] = numpy.rint(
+                quads[indices, columns] * float(scale[axis]) + offset[axis])
+
     def __repr__(self):
         return '<QuadManager ({0})>'.format(len(self))
 
@@ -533,62 +1419,137 @@ class Quad(object):
 class TileManager(object):
     """Handles tiles while sparing memory.
 
-    Keeps track of tiles as simple strings, but returns a Tile class on demand.
+    Keeps track of tiles in one contiguous bytearray with the raw tile data,
+    exactly as it is stored in a map file. Indexing returns a
+    :class:`TileView`, which reads and writes this data directly, so
+    changing a tile changes the layer:
 
-    .. note::
+    >>> layer.tiles[10].rotate('l')
 
-        Because TileManager generates :class:`Tile` classes on-the-fly, you
-        need to assign new tiles explicity. This will not work like you would
-        expect:
+    .. note::
 
-        >>> layer.tiles[10].rotate('l')
+        A view follows its position in the data, not the tile. Call
+        :meth:`TileView.copy` if you want to keep the values of a tile:
 
-        Instead, you need to re-assign the tile:
+        >>> solid = [tile.copy() for tile in layer.tiles if tile.index == 1]
 
-        >>> tile = layer.tiles[10]
-        >>> tile.rotate('l')
-        >>> layer.tiles[10] = tile
+        Tele and speedup tiles are still returned as copies.
 
-        We are searching for a better solution, in the meanwhile, use this
-        workaround
+    Tiles loaded from a map are saved without compressing them again until
+    they are modified. Accessing :attr:`tiles` counts as a modification,
+    because the bytearray could be changed in place.
 
     :param size: Fill up the manager with n empty tiles.
     :param tiles: List of tiles to put in.
-    :param data: Raw tile data, used internally.
+    :param data: Raw tile data as string, bytearray or list of tile strings,
+                 or a lazy reference to it, used internally.
+    :param source: Reference to the compressed tile data, used internally.
     :param _type: Used for a race modification, you probably don't need it
     """
 
-    def __init__(self, size=0, tiles=None, data=None, _type=0):
+    def __init__(self, size=0, tiles=None, data=None, source=None, _type=0):
         self.type = _type
+        # tele tiles are 2 bytes, speedup tiles are padded to 4 bytes
+        self.tile_size = 2 if _type == 1 else 4
+        self._lazy = None
         if tiles is not None:
-            self.tiles = [self._tile_to_string(tile) for tile in tiles]
+            self.tiles = ''.join([self._tile_to_string(tile) for tile in tiles])
+        elif hasattr(data, 'load'):
+            self._lazy = data
         elif data is not None:
             self.tiles = data
         else:
-            if _type == 1:
-                self.tiles = ['\x00\x00'] * size
-            else:
-                self.tiles = ['\x00\x00\x00\x00'] * size
+            self.tiles = bytearray(size * self.tile_size)
+        self._source = source
+
+    def _get_index(self, value):
+        """Returns the non-negative index or raises an IndexError."""
+        length = len(self)
+        if value < 0:
+            value += length
+        if not 0 <= value < length:
+            raise IndexError('tile index out of range')
+        return value
 
     def __getitem__(self, value):
+        tiles = self._get_tiles()
+        size = self.tile_size
         if isinstance(value, slice):
-            return TileManager(data=self.tiles[value])
+            start, stop, step = value.indices(len(self))
+            if step == 1:
+                return TileManager(data=tiles[start*size:max(start, stop)*size],
+                                   _type=self.type)
+            data = bytearray()
+            for i in xrange(start, stop, step):
+                data += tiles[i*size:(i+1)*size]
+            return TileManager(data=data, _type=self.type)
+        offset = self._get_index(value) * size
         if self.type == 1:
-            return TeleTile(self.tiles[value])
+            return TeleTile(str(tiles[offset:offset+size]))
         if self.type == 2:
-            return SpeedupTile(self.tiles[value])
-        return self._string_to_tile(self.tiles[value])
+            return SpeedupTile(str(tiles[offset:offset+size]))
+        return TileView(self, offset)
+
+    def __iter__(self):
+        if self.type != 0:
+            for i in xrange(len(self)):
+                yield self[i]
+            return
+        for offset in xrange(0, len(self._get_tiles()), self.tile_size):
+            yield TileView(self, offset)
 
     def __setitem__(self, k, v):
-        if isinstance(v, str):
-            if len(v) != 4:
-                raise ValueError('The string must be exactly 4 chars long.')
-            self.tiles[k] = v
-        else:
-            self.tiles[k] = self._tile_to_string(v)
+        if not isinstance(v, str):
+            v = self._tile_to_string(v)
+        elif len(v) != self.tile_size:
+            raise ValueError('The string must be exactly {0} chars '
+                             'long.'.format(self.tile_size))
+        offset = self._get_index(k) * self.tile_size
+        self.tiles[offset:offset+self.tile_size] = v
+
+    def load(self):
+        """Decompresses lazily loaded tiles right now."""
+        if self._lazy is not None:
+            self._tiles = bytearray(self._lazy.load())
+            self._lazy = None
+
+    def _get_tiles(self):
+        """Returns the tile data without marking it as modified."""
+        self.load()
+        return self._tiles
+
+    @property
+    def tiles(self):
+        """The raw tile data as bytearray."""
+        self._source = None
+        return self._get_tiles()
+
+    @tiles.setter
+    def tiles(self, value):
+        if isinstance(value, list):
+            value = ''.join(value)
+        if len(value) % self.tile_size:
+            raise ValueError('The size of the tile data must be a multiple '
+                             'of {0}.'.format(self.tile_size))
+        self._lazy = None
+        self._source = None
+        self._tiles = bytearray(value)
+
+    @property
+    def source(self):
+        """Reference to the compressed data loaded from a map or ``None`` if
+        the tiles were modified."""
+        return self._source
+
+    @property
+    def modified(self):
+        """``True`` unless the tiles were loaded from a map and not modified."""
+        return self._source is None
 
     def __len__(self):
-        return len(self.tiles)
+        if self._lazy is not None:
+            return len(self._lazy) / self.tile_size
+        return len(self._get_tiles()) / self.tile_size
 
     def _tile_to_string(self, tile):
         if self.type == 1:
@@ -597,10 +1558,6 @@ class TileManager(object):
             return pack('Bh', tile.force, tile.angle)
         return pack('4B', tile.index, tile._flags, tile.skip, tile.reserved)
 
-    def _string_to_tile(self, string):
-        index, flags, skip, reserved = unpack('4B', string)
-        return Tile(index=index, flags=flags, skip=skip, reserved=reserved)
-
     def __repr__(self):
         return '<TileManager ({0})>'.format(len(self))
 
@@ -677,6 +1634,42 @@ class Tile(object):
         return self.index == other.index and self.flags == other.flags and \
            self.skip == other.skip and self.reserved == other.reserved
 
+def _tile_field(pos, doc):
+    """Returns a property for the byte at `pos` of a :class:`TileView`."""
+    def getter(self):
+        return self._manager._tiles[self._offset+pos]
+    def setter(self, value):
+        self._manager.tiles[self._offset+pos] = value
+    return property(getter, setter, doc=doc)
+
+class TileView(Tile):
+    """A :class:`Tile` bound to the data of a :class:`TileManager`.
+
+    Returned when indexing a manager. The attributes are read from and
+    written to the tile data of the manager, no data is copied.
+
+    :param manager: The manager of the tile.
+    :param offset: Position of the tile in the tile data in bytes.
+    """
+
+    __slots__ = ('_manager', '_offset')
+
+    index = _tile_field(0, 'Index of the tile in the mapres.')
+    _flags = _tile_field(1, 'Raw flags of the tile.')
+    skip = _tile_field(2, 'Number of following empty tiles.')
+    reserved = _tile_field(3, 'Unused.')
+
+    def __init__(self, manager, offset):
+        self._manager = manager
+        self._offset = offset
+
+    def copy(self):
+        """Returns a :class:`Tile` with the current values, which is not
+        bound to the manager."""
+        index, flags, skip, reserved = unpack_from('4B', self._manager._tiles,
+                                                   self._offset)
+        return Tile(index=index, flags=flags, skip=skip, reserved=reserved)
+
 class TeleTile(object):
     """Represents a tele tile of a tilelayer. Only for race modification."""
 
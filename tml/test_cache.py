@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import threading
+import unittest
+
+from cache import TeemapCache
+
+class TestTeemapCache(unittest.TestCase):
+
+    def setUp(self):
+        os.mkdir('test_tmp')
+        shutil.copyfile('tml/test_maps/vanilla.map', 'test_tmp/vanilla.map')
+        shutil.copyfile('tml/maps/dm1.map', 'test_tmp/dm1.map')
+        shutil.copyfile('tml/maps/dm2.map', 'test_tmp/dm2.map')
+        self.cache = TeemapCache()
+
+    def tearDown(self):
+        if os.path.isdir('test_tmp'):
+            shutil.rmtree('test_tmp')
+
+    def test_load(self):
+        teemap = self.cache.load('test_tmp/vanilla')
+        self.assertEqual(len(teemap.layers), 6)
+        self.assertEqual(teemap.name, 'vanilla')
+        self.assertIs(self.cache.load('test_tmp/vanilla.map'), teemap)
+        self.assertEqual(self.cache.hits, 1)
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(len(self.cache), 1)
+        self.assertGreater(self.cache.memory,
+                           os.path.getsize('test_tmp/vanilla.map'))
+
+    def test_copy(self):
+        teemap = self.cache.load('test_tmp/vanilla')
+        copy = self.cache.load('test_tmp/vanilla', copy=True)
+        self.assertIsNot(copy, teemap)
+        self.assertIsNot(copy.gamelayer, teemap.gamelayer)
+        self.assertEqual(copy.gamelayer.tiles.tiles, teemap.gamelayer.tiles.tiles)
+        self.assertEqual(self.cache.stats['hits'], 1)
+
+    def test_invalidation(self):
+        teemap = self.cache.load('test_tmp/vanilla')
+        cache_memory = self.cache.memory
+        stat = os.stat('test_tmp/vanilla.map')
+        os.utime('test_tmp/vanilla.map', (stat.st_atime, stat.st_mtime + 10))
+        self.assertIsNot(self.cache.load('test_tmp/vanilla'), teemap)
+        self.assertEqual(self.cache.misses, 2)
+        self.assertEqual(len(self.cache), 1)
+        self.assertEqual(self.cache.memory, cache_memory)
+
+        cache = TeemapCache(check_hash=True)
+        teemap = cache.load('test_tmp/vanilla')
+        self.assertIs(cache.load('test_tmp/vanilla'), teemap)
+        stat = os.stat('test_tmp/vanilla.map')
+        with open('test_tmp/vanilla.map', 'r+b') as f:
+            f.seek(12) # swaplen, not used by the reader
+            f.write('\x00\x00\x00\x00')
+        os.utime('test_tmp/vanilla.map', (stat.st_atime, stat.st_mtime))
+        memory = cache.memory
+        self.assertIsNot(cache.load('test_tmp/vanilla'), teemap)
+        self.assertEqual(cache.misses, 2)
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.memory, memory)
+
+        self.cache.invalidate('test_tmp/vanilla')
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.memory, 0)
+
+    def test_threads(self):
+        threads = [threading.Thread(target=self.cache.load, args=('test_tmp/dm1',))
+                   for i in xrange(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.cache.hits + self.cache.misses, 8)
+        self.assertEqual(len(self.cache), 1)
+        cache = TeemapCache()
+        cache.load('test_tmp/dm1')
+        self.assertEqual(self.cache.memory, cache.memory)
+
+    def test_eviction(self):
+        cache = TeemapCache(max_entries=2)
+        dm1 = cache.load('test_tmp/dm1')
+        cache.load('test_tmp/dm2')
+        cache.load('test_tmp/dm1')
+        cache.load('test_tmp/vanilla')
+        self.assertEqual(cache.evictions, 1)
+        self.assertIs(cache.load('test_tmp/dm1'), dm1)
+        self.assertEqual(cache.stats, {'hits': 2, 'misses': 3, 'evictions': 1,
+                                       'entries': 2, 'memory': cache.memory})
+
+        cache = TeemapCache()
+        cache.load('test_tmp/dm1')
+        cache.load('test_tmp/vanilla')
+        cache = TeemapCache(max_memory=cache.memory - 1)
+        cache.load('test_tmp/dm1')
+        cache.load('test_tmp/vanilla')
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.evictions, 1)
+        cache.clear()
+        self.assertEqual(cache.stats['evictions'], 0)
+        self.assertEqual(cache.memory, 0)
+
+if __name__ == '__main__':
+    unittest.main()
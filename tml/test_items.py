@@ -1,9 +1,15 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+from array import array
+import random
 import unittest
-from items import Layer, TileLayer, TileManager, Tile, QuadLayer, QuadManager, \
-     Quad
+from constants import TILEFLAG_HFLIP, TILEFLAG_VFLIP, TILEFLAG_ROTATE, \
+     CURVETYPE_STEP, CURVETYPE_LINEAR, CURVETYPE_SLOW, CURVETYPE_FAST, \
+     CURVETYPE_SMOOTH
+from items import Layer, TileLayer, TileManager, Tile, TileView, TeleTile, \
+     QuadLayer, QuadManager, Quad, Envelope, Envpoint, EnvpointManager, \
+     EnvelopeEvaluator, numpy
 
 class TestTileLayer(unittest.TestCase):
 
@@ -164,10 +170,223 @@ class TestTileLayer(unittest.TestCase):
         self.assertEqual(self.layer.get_tile(49, 48).index, 10)
         self.assertEqual(self.layer.get_tile(49, 49).index, 0)
 
+    def test_draw_clipping(self):
+        layer = TileLayer(3, 3)
+        layer.fill(0, 0, 3, 3, Tile(7))
+        layer.set_tile(2, 2, Tile(8))
+        self.layer.draw(-2, -2, layer)
+        self.assertEqual(self.layer.get_tile(0, 0).index, 8)
+        self.assertEqual(self.layer.get_tile(1, 0).index, 0)
+        self.assertEqual(self.layer.get_tile(0, 1).index, 0)
+        self.layer.draw(48, -1, layer)
+        self.assertEqual(self.layer.get_tile(48, 0).index, 7)
+        self.assertEqual(self.layer.get_tile(49, 1).index, 7)
+        self.assertEqual(self.layer.get_tile(47, 1).index, 0)
+        self.layer.draw(50, 0, layer)
+        self.layer.draw(-3, 0, layer)
+        self.assertEqual(self.layer.histogram(), {0: 2469, 1: 26, 7: 4, 8: 1})
+
+        selection = self.layer.select(-1, -1, 3, 3)
+        self.assertEqual((selection.width, selection.height), (2, 2))
+        self.assertEqual(selection.get_tile(0, 0).index, 8)
+
+    def test_race_tiles(self):
+        layer = TileLayer(4, 4, game=2)
+        layer.tele_tiles[5] = TeleTile('\x03\x1a')
+        selection = layer.select(1, 1, 2, 2)
+        self.assertEqual(selection.tele_tiles[0].number, 3)
+        dest = TileLayer(5, 5, game=2)
+        dest.draw(2, 2, selection)
+        self.assertEqual(dest.get_tele_tile(2, 2).number, 3)
+        dest.width = 3
+        dest.height = 8
+        self.assertEqual(len(dest.tele_tiles), 24)
+        self.assertEqual(dest.get_tele_tile(2, 2).number, 3)
+        dest.width = 0
+        self.assertEqual(len(dest.tiles), 0)
+        self.assertEqual(len(dest.tele_tiles), 0)
+
+    def test_fill(self):
+        self.layer.fill(48, 47, 5, 2, Tile(3))
+        self.assertEqual(self.layer.get_tile(48, 47).index, 3)
+        self.assertEqual(self.layer.get_tile(49, 48).index, 3)
+        self.assertEqual(self.layer.get_tile(47, 47).index, 0)
+        self.assertEqual(self.layer.get_tile(48, 49).index, 0)
+        self.layer.fill(-2, -2, 3, 3, '\x04\x00\x00\x00')
+        self.assertEqual(self.layer.get_tile(0, 0).index, 4)
+        self.assertEqual(self.layer.get_tile(1, 0).index, 0)
+        self.assertEqual(self.layer.histogram(), {0: 2469, 1: 26, 3: 4, 4: 1})
+        self.assertRaises(ValueError, self.layer.fill, 0, 0, 2, 2, '\x01')
+        self.assertEqual(len(self.layer.tiles), 2500)
+
+    def test_replace(self):
+        self.assertEqual(self.layer.replace(1, 2), 26)
+        self.assertEqual(self.layer.replace(1, 2), 0)
+        self.assertEqual(self.layer.histogram(), {0: 2474, 2: 26})
+
+    def test_flags(self):
+        self.layer.set_flags(TILEFLAG_HFLIP | TILEFLAG_VFLIP, 19, 0, 2, 2)
+        self.assertEqual(self.layer.get_tile(20, 1)._flags,
+                         TILEFLAG_HFLIP | TILEFLAG_VFLIP)
+        self.assertEqual(self.layer.get_tile(19, 0)._flags,
+                         TILEFLAG_HFLIP | TILEFLAG_VFLIP)
+        self.assertEqual(self.layer.get_tile(21, 1)._flags, 0)
+        self.assertEqual(self.layer.get_tile(20, 2)._flags, 0)
+        self.layer.clear_flags(TILEFLAG_VFLIP)
+        self.assertEqual(self.layer.get_tile(20, 1)._flags, TILEFLAG_HFLIP)
+        self.assertEqual(self.layer.get_tile(20, 1).index, 1)
+
+    def test_find(self):
+        self.assertEqual(self.layer.find(1)[:3], [(20, 0), (40, 0), (41, 0)])
+        self.assertEqual(len(self.layer.find(1)), 26)
+        self.layer.set_tile(3, 3, Tile(5))
+        self.assertEqual(self.layer.find([5, 6]), [(3, 3)])
+        self.assertEqual(len(self.layer.find(lambda index: index > 0)), 27)
+        self.assertEqual(self.layer.find(7), [])
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_as_array(self):
+        tiles = self.layer.as_array()
+        self.assertEqual(tiles.shape, (50, 50))
+        self.assertEqual(tiles['index'][0, 20], 1)
+        self.assertEqual(tiles['index'].sum(), 26)
+        tiles['index'][2, 3] = 5
+        tiles['flags'][2, 3] = TILEFLAG_HFLIP
+        self.assertEqual(self.layer.get_tile(3, 2).index, 5)
+        self.assertEqual(self.layer.get_tile(3, 2)._flags, TILEFLAG_HFLIP)
+        self.layer.set_tile(4, 2, Tile(7))
+        self.assertEqual(tiles['index'][2, 4], 7)
+        self.assertRaises(ValueError, self.layer.as_tele_array)
+
+        layer = TileLayer(3, 2, game=2)
+        layer.tele_tiles[4] = TeleTile('\x02\x1a')
+        tele = layer.as_tele_array()
+        self.assertEqual(tele.shape, (2, 3))
+        self.assertEqual(tele['number'][1, 1], 2)
+        self.assertEqual(tele['type'][1, 1], 26)
+        layer = TileLayer(3, 2, game=4)
+        speedup = layer.as_speedup_array()
+        speedup['angle'][0, 2] = -90
+        self.assertEqual(layer.speedup_tiles[2].angle, -90)
+
 class TestTileManager(unittest.TestCase):
 
     def test_init(self):
-        pass
+        manager = TileManager(10)
+        self.assertEqual(len(manager), 10)
+        self.assertEqual(manager.tiles, bytearray(40))
+        manager = TileManager(tiles=[Tile(1), Tile(2, skip=3)])
+        self.assertEqual(manager.tiles, bytearray('\x01\x00\x00\x00\x02\x00\x03\x00'))
+        manager = TileManager(data=['\x01\x00\x00\x00', '\x02\x00\x00\x00'])
+        self.assertEqual(manager[1].index, 2)
+        manager = TileManager(5, _type=1)
+        self.assertEqual(len(manager), 5)
+        self.assertEqual(len(manager.tiles), 10)
+        self.assertRaises(ValueError, TileManager, data='\x00\x00\x00')
+
+    def test_items(self):
+        manager = TileManager(10)
+        manager[3] = Tile(5, flags=TILEFLAG_HFLIP)
+        manager[-1] = '\x07\x00\x00\x00'
+        self.assertEqual(manager[3].index, 5)
+        self.assertEqual(manager[3]._flags, TILEFLAG_HFLIP)
+        self.assertEqual(manager[9].index, 7)
+        self.assertEqual([tile.index for tile in manager],
+                         [0, 0, 0, 5, 0, 0, 0, 0, 0, 7])
+        self.assertRaises(IndexError, manager.__getitem__, 10)
+        self.assertRaises(IndexError, manager.__setitem__, 10, Tile())
+        self.assertRaises(ValueError, manager.__setitem__, 0, '\x00')
+        self.assertEqual(len(manager[2:5]), 3)
+        self.assertEqual(manager[2:5][1].index, 5)
+        self.assertEqual([tile.index for tile in manager[::3]], [0, 5, 0, 7])
+
+        manager = TileManager(3, _type=1)
+        manager[1] = TeleTile('\x02\x1a')
+        self.assertEqual(manager[1].number, 2)
+        self.assertEqual(manager[1].type, 26)
+
+    def test_views(self):
+        manager = TileManager(10, source=object())
+        tile = manager[3]
+        self.assertIsInstance(tile, TileView)
+        self.assertFalse(manager.modified)
+        tile.index = 4
+        tile.rotate('r')
+        self.assertTrue(manager.modified)
+        self.assertEqual(manager.tiles[12:16], bytearray('\x04\x08\x00\x00'))
+        manager[2].hflip()
+        self.assertTrue(manager[2].flags['hflip'])
+        copy = tile.copy()
+        tile.index = 5
+        self.assertEqual(copy.index, 4)
+        self.assertEqual(copy, Tile(4, flags=TILEFLAG_ROTATE))
+        manager[5] = copy
+        self.assertEqual(manager[5], copy)
+
+        for tile in manager:
+            tile.skip = 1
+        self.assertEqual(manager.tiles[2::4], bytearray('\x01' * 10))
+        tiles = list(manager)
+        self.assertEqual([tile.index for tile in tiles[3:6]], [5, 0, 4])
+
+@unittest.skipIf(numpy is None, 'NumPy is not installed')
+class TestEnvelopeEvaluator(unittest.TestCase):
+
+    def setUp(self):
+        self.envelope = Envelope(envpoints=[
+            Envpoint(0, CURVETYPE_LINEAR, [0, 1024]),
+            Envpoint(1000, CURVETYPE_STEP, [1024, 0]),
+            Envpoint(2000, CURVETYPE_SMOOTH, [2048]),
+            Envpoint(3000, CURVETYPE_SLOW, [0]),
+            Envpoint(4000, CURVETYPE_FAST, [1024]),
+            Envpoint(5000, CURVETYPE_LINEAR, [0]),
+        ])
+
+    def test_curves(self):
+        values = self.envelope.evaluate([0, 500, 1000, 1500, 2000, 2500, 3500,
+                                         4500, 5000, 5500, -100])
+        self.assertEqual(values.shape, (11, 4))
+        self.assertEqual(list(values[:, 0]), [0, 0.5, 1, 1, 1, 1, 0.125, 0.125,
+                                              0, 0.5, 0])
+        self.assertEqual(list(values[:2, 1]), [1, 0.5])
+
+    def test_batch(self):
+        envelopes = [self.envelope, Envelope(envpoints=[]),
+                     Envelope(envpoints=[Envpoint(10, 1, [5120])]),
+                     Envelope(envpoints=self.envelope.envpoints, synced=False)]
+        evaluator = EnvelopeEvaluator(envelopes)
+        values = evaluator.evaluate([250, 2500], offsets=[0, 0, 0, 100],
+                                    local_times=[0, 0])
+        self.assertEqual(values.shape, (4, 2, 4))
+        self.assertEqual(values[:3, :, 0].tolist(),
+                         [[0.25, 1], [0, 0], [5, 5]])
+        self.assertEqual(values[3, :, 0].tolist(), [0.1, 0.1])
+        self.assertEqual(EnvelopeEvaluator([]).evaluate([1, 2]).shape, (0, 2, 4))
+
+class TestEnvpointManager(unittest.TestCase):
+
+    def test_views(self):
+        manager = EnvpointManager([Envpoint(i * 100, 1, [i]) for i in xrange(6)])
+        self.assertEqual(len(manager), 6)
+        self.assertEqual(manager[2].values, [2, 0, 0, 0])
+        envelope = Envelope(envpoints=manager.view(2, 3))
+        self.assertEqual([point.time for point in envelope.envpoints],
+                         [200, 300, 400])
+
+        envelope.envpoints[0].time = 250
+        envelope.envpoints[-1] = Envpoint(450, 0, [4, 4, 4, 4])
+        self.assertEqual(manager[2].time, 250)
+        self.assertEqual(manager[4].values, [4, 4, 4, 4])
+        self.assertRaises(IndexError, envelope.envpoints.__getitem__, 3)
+
+        point = envelope.envpoints.pop(0)
+        self.assertEqual(point.time, 250)
+        envelope.envpoints.insert(1, Envpoint(350, 1, [3]))
+        self.assertEqual([point.time for point in envelope.envpoints],
+                         [300, 350, 450])
+        self.assertEqual(len(manager), 6)
+        self.assertEqual(manager[2].time, 250)
+        self.assertEqual(len(manager[1:4]), 3)
 
 class TestQuadLayer(unittest.TestCase):
 
@@ -179,6 +398,27 @@ class TestQuadLayer(unittest.TestCase):
         self.assertTrue(isinstance(layer.quads, QuadManager))
         self.assertEqual(QuadLayer('TeeWar').name, 'TeeWar')
 
+    def test_queries(self):
+        def quad(x, y, size=64):
+            return Quad(points=[(x, y), (x + size, y), (x, y + size),
+                                (x + size, y + size), (x, y)])
+        layer = QuadLayer(quads=QuadManager([quad(i * 100, 0)
+                                             for i in xrange(10)]))
+        self.assertEqual(layer.quads_in(170, -10, 200, 20), [2, 3])
+        self.assertEqual(layer.quads_at(64, 64), [0])
+        self.assertEqual(layer.quads_at(80, 0), [])
+
+        layer.quads.append(quad(-5000, -5000, 10000))
+        layer.quads[0] = quad(0, 1000)
+        self.assertEqual(layer.quads_at(10, 10), [10])
+        self.assertEqual(layer.quads_at(10, 1010), [0, 10])
+        layer.quads.pop(1)
+        self.assertEqual(layer.quads_in(150, -10, 200, 20), [1, 2, 9])
+        self.assertEqual(len(layer.quads.get_index()), 10)
+
+        layer.quads.quads[0:10] = array('i', [20000, 0] * 5)
+        self.assertEqual(layer.quads_at(20000, 0), [0])
+
 class TestQuadManager(unittest.TestCase):
 
     def setUp(self):
@@ -223,5 +463,86 @@ class TestQuadManager(unittest.TestCase):
         quad = self.manager.pop(-1)
         self.assertEqual(quad, orig_quad)
 
+    def test_slice(self):
+        self.manager[3] = Quad(pos_env=3)
+        manager = self.manager[2:6]
+        self.assertEqual(len(manager), 4)
+        self.assertEqual(manager[1], Quad(pos_env=3))
+        self.assertEqual(len(self.manager[1::3]), 3)
+        self.assertEqual(self.manager[::3][1], Quad(pos_env=3))
+        self.assertRaises(IndexError, self.manager.__getitem__, 10)
+
+    @unittest.skipIf(numpy is None, 'NumPy is not installed')
+    def test_transforms(self):
+        self.manager.translate(9.6, 20.2, indices=[1, 2])
+        self.assertEqual(self.manager[0], Quad())
+        self.assertEqual(self.manager[1].points,
+                         [(10, 20), (74, 20), (10, 84), (74, 84), (42, 52)])
+
+        self.manager.scale(2, indices=0)
+        self.assertEqual(self.manager[0].points,
+                         [(-32, -32), (96, -32), (-32, 96), (96, 96), (32, 32)])
+        self.manager.rotate(90, indices=slice(1, 3))
+        self.assertEqual(self.manager[2].points,
+                         [(74, 20), (74, 84), (10, 20), (10, 84), (42, 52)])
+        self.manager.rotate(-90, indices=slice(1, 3))
+        self.assertEqual(self.manager[2].points,
+                         [(10, 20), (74, 20), (10, 84), (74, 84), (42, 52)])
+
+        self.manager.recolor((1, 2, 3, 4))
+        self.assertEqual(self.manager[5].colors, [(1, 2, 3, 4)] * 4)
+        colors = [(i, i, i, 255) for i in xrange(4)]
+        self.manager.recolor(colors, indices=[False] * 9 + [True])
+        self.assertEqual(self.manager[9].colors, colors)
+        self.assertEqual(self.manager[8].colors, [(1, 2, 3, 4)] * 4)
+
+        self.manager.remap_texcoords((0.5, 2), (100, 0), indices=4)
+        self.assertEqual(self.manager[4].texcoords,
+                         [(100, 0), (612, 0), (100, 2048), (612, 2048)])
+
+        quads = self.manager.as_array()
+        self.assertEqual(quads.shape, (10, 38))
+        quads[3, 34] = 2
+        self.assertEqual(self.manager[3].pos_env, 2)
+        # the view keeps the old quads when the number of quads changes
+        for i in xrange(2000):
+            self.manager.append(Quad())
+        self.manager.pop(0)
+        quads[:] = 7
+        self.assertEqual(self.manager[2].pos_env, 2)
+        self.assertEqual(len(self.manager), 2009)
+        quads = self.manager.as_array()
+        quads[0, 34] = 7
+        self.assertEqual(self.manager[0].pos_env, 7)
+
+    def test_index(self):
+        rand = random.Random(0)
+        def random_quad():
+            x, y = rand.randint(-5000, 5000), rand.randint(-5000, 5000)
+            w, h = rand.randint(0, 500), rand.randint(0, 500)
+            return Quad(points=[(x, y), (x + w, y), (x, y + h),
+                                (x + w, y + h), (x, y)])
+        quads = [random_quad() for i in xrange(200)]
+        manager = QuadManager(quads)
+        for i in xrange(100):
+            action = rand.randint(0, 2)
+            if action == 0:
+                k = rand.randrange(len(quads))
+                quads[k] = manager[k] = random_quad()
+            elif action == 1:
+                quads.append(random_quad())
+                manager.append(quads[-1])
+            else:
+                k = rand.randrange(len(quads))
+                self.assertEqual(manager.pop(k), quads.pop(k))
+            x0, y0 = rand.randint(-6000, 6000), rand.randint(-6000, 6000)
+            x1, y1 = x0 + rand.randint(0, 2000), y0 + rand.randint(0, 2000)
+            expected = [k for k, quad in enumerate(quads)
+                        if min(p[0] for p in quad.points[:4]) <= x1 and
+                           max(p[0] for p in quad.points[:4]) >= x0 and
+                           min(p[1] for p in quad.points[:4]) <= y1 and
+                           max(p[1] for p in quad.points[:4]) >= y0]
+            self.assertEqual(manager.query(x0, y0, x1, y1), expected)
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,8 +6,12 @@ import os
 import shutil
 import unittest
 import warnings
+import zlib
 
-from tml import Teemap, MapError
+from tml import Teemap, MapError, load_many
+from constants import ITEM_VERSION, ITEM_INFO, ITEM_LAYER, ITEM_ENVELOPE, \
+     LAYERTYPE_TILES
+from datafile import DataFileReader, _open_for_writing
 import items
 
 class TestTeemap(unittest.TestCase):
@@ -31,6 +35,317 @@ class TestTeemap(unittest.TestCase):
         #assert Teemap('tml/maps/dm1.map')
         #assert Teemap('tml/maps/dm1')
 
+    def test_lazy(self):
+        teemap = Teemap('tml/test_maps/vanilla', lazy=True)
+        layer = teemap.layers[2]
+        self.assertIsNotNone(layer.tiles._lazy)
+        self.assertEqual(len(layer.tiles), 15)
+        self.assertIsNotNone(layer.tiles._lazy)
+        for i, tile in enumerate(layer.tiles[:5]):
+            self.assertEqual(tile.index, i)
+        self.assertIsNone(layer.tiles._lazy)
+        self.assertEqual(layer.tiles.tiles, self.teemap.layers[2].tiles.tiles)
+        self.assertEqual(len(teemap.layers[1].quads), 2)
+        self.assertEqual(teemap.layers[1].quads[1],
+                         self.teemap.layers[1].quads[1])
+        teemap.save('test_tmp/lazy.map')
+        self.teemap.save('test_tmp/copy.map')
+        self.assertTrue(filecmp.cmp('test_tmp/lazy.map', 'test_tmp/copy.map'))
+
+    def test_datafile(self):
+        datafile = DataFileReader('tml/test_maps/vanilla', lazy=True)
+        size, data = datafile.find_item(ITEM_VERSION, 0)
+        self.assertEqual(size, 4)
+        self.assertIsInstance(data, buffer)
+        self.assertEqual(datafile.find_item_ints(ITEM_VERSION, 0), (1,))
+        self.assertIsNone(datafile.find_item_ints(ITEM_INFO, 0))
+        self.assertIsInstance(datafile.get_compressed_data(0), buffer)
+        datafile.close()
+
+    def test_raw_items(self):
+        datafile = DataFileReader('tml/test_maps/vanilla', load=False)
+        self.assertEqual(datafile.get_item_type(ITEM_LAYER), (13, 6))
+        self.assertEqual(datafile.get_item_type(ITEM_INFO), (0, 0))
+        self.assertEqual(len(datafile.item_index), datafile.header.num_items)
+        self.assertEqual(datafile.item_index[(ITEM_LAYER, 2)], 15)
+        self.assertEqual(datafile.get_raw_item(ITEM_VERSION, 0), (1,))
+        self.assertIsNone(datafile.get_raw_item(ITEM_LAYER, 6))
+        raw_items = list(datafile.iter_items())
+        self.assertEqual(len(raw_items), datafile.header.num_items)
+        self.assertEqual(raw_items[0], (ITEM_VERSION, 0, (1,)))
+        envelopes = list(datafile.iter_items(ITEM_ENVELOPE))
+        self.assertEqual([id_ for _, id_, _ in envelopes], [0, 1])
+        self.assertEqual(envelopes[1][2][2:4], (4, 5))
+        blocks = list(datafile.iter_data())
+        self.assertEqual(len(blocks), datafile.header.num_raw_data)
+        self.assertEqual(zlib.decompress(blocks[0][1]), 'grass_main\x00')
+        self.assertEqual(blocks[0][2], 11)
+        envelopes = datafile.load_envelopes(datafile.load_envpoints())
+        self.assertEqual([env.name for env in envelopes], ['PosEnv', 'ColorEnv'])
+        datafile.close()
+
+    def test_peek(self):
+        summary = Teemap.peek('tml/test_maps/vanilla')
+        self.assertEqual(summary.name, 'vanilla')
+        self.assertIsNone(summary.info)
+        self.assertEqual((summary.width, summary.height), (50, 50))
+        self.assertEqual(summary.images, ['grass_main', 'test', 'test2'])
+        self.assertEqual(summary.num_groups, 7)
+        self.assertEqual(summary.num_layers, 6)
+        self.assertEqual(Teemap.peek('tml/maps/dm1').images,
+                         [image.name for image in Teemap('tml/maps/dm1').images])
+
+    def test_load_many(self):
+        paths = ['tml/test_maps/vanilla', 'tml/maps/dm1', 'test_tmp/missing',
+                 'tml/maps/ctf1']
+        for workers in (1, 2):
+            results = list(load_many(paths, workers=workers))
+            self.assertEqual([path for path, _, _ in results], paths)
+            for path, teemap, error in results:
+                if path == 'test_tmp/missing':
+                    self.assertIsNone(teemap)
+                    self.assertIsInstance(error, IOError)
+                else:
+                    self.assertIsNone(error)
+                    self.assertEqual(len(teemap.layers),
+                                     len(Teemap(path).layers))
+        results = load_many(paths, workers=2, ordered=False)
+        self.assertEqual(sorted(path for path, _, _ in results), sorted(paths))
+
+    def test_bytes(self):
+        with open('tml/test_maps/vanilla.map', 'rb') as f:
+            data = f.read()
+        self.teemap.save('test_tmp/copy.map')
+        with open('test_tmp/copy.map', 'rb') as f:
+            saved = f.read()
+        self.assertEqual(self.teemap.to_bytes(), saved)
+        for lazy in (False, True):
+            teemap = Teemap.from_bytes(data, lazy=lazy)
+            self.assertEqual(len(teemap.layers), 6)
+            self.assertEqual(teemap.to_bytes(), saved)
+        with open('tml/test_maps/vanilla.map', 'rb') as f:
+            teemap = Teemap.from_file(f)
+        self.assertEqual(teemap.to_bytes(), saved)
+        with open('test_tmp/file.map', 'wb') as f:
+            teemap.save(f)
+        self.assertTrue(filecmp.cmp('test_tmp/file.map', 'test_tmp/copy.map'))
+        self.assertRaises(ValueError, teemap.save, 'test_tmp/copy.txt')
+
+    def test_threads(self):
+        saved = self.teemap.to_bytes()
+        teemap = Teemap('tml/maps/ctf5', threads=4)
+        self.assertEqual(teemap.to_bytes(), Teemap('tml/maps/ctf5').to_bytes())
+        teemap = Teemap('tml/test_maps/vanilla', threads=4)
+        self.assertEqual(teemap.to_bytes(), saved)
+        teemap.save('test_tmp/threads.map', threads=4)
+        with open('test_tmp/threads.map', 'rb') as f:
+            self.assertEqual(f.read(), saved)
+
+    def test_save_stream(self):
+        class Stream(object):
+            """Write-only file without seek and tell."""
+            def __init__(self):
+                self.parts = []
+            def write(self, data):
+                self.parts.append(data)
+        saved = self.teemap.to_bytes()
+        stream = Stream()
+        self.teemap.save(stream)
+        self.assertEqual(''.join(stream.parts), saved)
+        stream = Stream()
+        self.teemap.save(stream, threads=4)
+        self.assertEqual(''.join(stream.parts), saved)
+        self.teemap.save('test_tmp/stream.map', threads=3)
+        with open('test_tmp/stream.map', 'rb') as f:
+            self.assertEqual(f.read(), saved)
+
+    def test_save_errors(self):
+        self.assertRaises(IOError, self.teemap.save, 'test_tmp/missing/x.map')
+        def fail():
+            with _open_for_writing('test_tmp/x.map', replace=True) as f:
+                f.write('DATA')
+                raise ValueError
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(os.listdir('test_tmp'), [])
+
+    def test_save_symlink(self):
+        self.teemap.save('test_tmp/target.map')
+        os.chmod('test_tmp/target.map', 0600)
+        os.symlink('target.map', 'test_tmp/link.map')
+        for lazy in (False, True):
+            Teemap('test_tmp/link.map', lazy=lazy).save('test_tmp/link.map')
+            self.assertTrue(os.path.islink('test_tmp/link.map'))
+            self.assertEqual(os.stat('test_tmp/target.map').st_mode & 0777,
+                             0600)
+            self.assertEqual(sorted(os.listdir('test_tmp')),
+                             ['link.map', 'target.map'])
+        self.assertEqual(Teemap('test_tmp/link.map').gamelayer.tiles.tiles,
+                         self.teemap.gamelayer.tiles.tiles)
+
+    def test_copy_through(self):
+        original = DataFileReader('tml/test_maps/vanilla', load=False)
+        blocks = set(str(data) for index, data, size in original.iter_data())
+        original.close()
+        for lazy in (False, True):
+            teemap = Teemap('tml/test_maps/vanilla', lazy=lazy)
+            self.assertFalse(teemap.gamelayer.tiles.modified)
+            tile_index = teemap.gamelayer.tiles[0].index
+            teemap.gamelayer.tiles[0] = items.Tile(index=tile_index + 1)
+            self.assertTrue(teemap.gamelayer.tiles.modified)
+            self.assertFalse(teemap.layers[2].tiles.modified)
+            datafile = DataFileReader(data=teemap.to_bytes(), load=False)
+            copied = [str(data) in blocks for index, data, size in datafile.iter_data()]
+            self.assertEqual(copied.count(False), 1)
+            saved = Teemap.from_bytes(datafile.data)
+            self.assertEqual(saved.gamelayer.tiles[0].index, tile_index + 1)
+            self.assertEqual(saved.layers[2].tiles.tiles,
+                             teemap.layers[2].tiles.tiles)
+            self.assertEqual(saved.images[1].data, teemap.images[1].data)
+        teemap.save('test_tmp/vanilla')
+        Teemap('test_tmp/vanilla', lazy=True).save('test_tmp/vanilla')
+        self.assertEqual(Teemap('test_tmp/vanilla').gamelayer.tiles.tiles,
+                         teemap.gamelayer.tiles.tiles)
+
+    def test_dedup_data(self):
+        datafile = DataFileReader(data=self.teemap.to_bytes(), load=False)
+        num_raw_data = datafile.header.num_raw_data
+        layer = self.teemap.layers[4]
+        group = self.teemap.groups[-1]
+        group.layers.append(items.TileLayer(layer.width, layer.height,
+                            tiles=items.TileManager(data=bytearray(layer.tiles.tiles))))
+        group.layers.append(items.TileLayer(game=2))
+        group.layers.append(items.TileLayer(game=2))
+        datafile = DataFileReader(data=self.teemap.to_bytes(), load=False)
+        # the copied layer shares its data, the tele layers share the zeroed
+        # tile data and their tele data
+        self.assertEqual(datafile.header.num_raw_data, num_raw_data + 2)
+        teemap = Teemap.from_bytes(datafile.data)
+        self.assertEqual(teemap.layers[-3].tiles.tiles, layer.tiles.tiles)
+        self.assertEqual(len(teemap.layers[-1].tele_tiles), 50*50)
+
+    def test_dedup_gamelayer(self):
+        # the client changes the tiles of the gamelayer in place, a layer
+        # with the same tiles must not share the block
+        gamelayer = self.teemap.gamelayer
+        self.teemap.groups[-1].layers.append(items.TileLayer(gamelayer.width,
+            gamelayer.height, tiles=items.TileManager(data=bytearray(gamelayer.tiles.tiles))))
+        datafile = DataFileReader(data=self.teemap.to_bytes(), load=False)
+        indices = [ints[14] for type_, id_, ints in datafile.iter_items(ITEM_LAYER)
+                   if ints[1] == LAYERTYPE_TILES]
+        self.assertEqual(len(set(indices)), len(indices))
+
+    def test_compression(self):
+        original = Teemap('tml/maps/ctf5')
+        sizes = {}
+        for compression in ('fast', 'default', 'smallest'):
+            teemap = Teemap('tml/maps/ctf5')
+            # modify all tiles, so they are compressed again
+            for layer in teemap.layers:
+                if layer.type == 'tilelayer':
+                    layer.tiles.tiles = bytearray(layer.tiles.tiles)
+            teemap.save('test_tmp/{0}.map'.format(compression), threads=2,
+                        compression=compression)
+            sizes[compression] = os.path.getsize('test_tmp/{0}.map'.format(compression))
+            saved = Teemap('test_tmp/{0}'.format(compression))
+            for layer, saved_layer in zip(original.layers, saved.layers):
+                if layer.type == 'tilelayer':
+                    self.assertEqual(saved_layer.tiles.tiles, layer.tiles.tiles)
+        self.assertLessEqual(sizes['smallest'], sizes['default'])
+        self.assertLessEqual(sizes['default'], sizes['fast'])
+        self.assertRaises(ValueError, teemap.save, 'test_tmp/invalid',
+                          compression='best')
+
+    def test_skip_tiles(self):
+        self.teemap.save('test_tmp/skip.map', skip_tiles=True)
+        datafile = DataFileReader('test_tmp/skip.map', load=False)
+        versions = [ints[3] for type_, id_, ints in datafile.iter_items(ITEM_LAYER)
+                    if ints[1] == LAYERTYPE_TILES]
+        self.assertEqual(versions, [4, 4, 4, 4])
+        self.assertLess(sum(datafile.data_sizes),
+                        sum(DataFileReader(data=self.teemap.to_bytes(),
+                                           load=False).data_sizes))
+        datafile.close()
+        for lazy in (False, True):
+            teemap = Teemap('test_tmp/skip', lazy=lazy)
+            self.assertEqual(len(teemap.gamelayer.tiles), 50*50)
+            for layer, saved_layer in zip(self.teemap.layers, teemap.layers):
+                if layer.type == 'tilelayer':
+                    self.assertEqual(saved_layer.tiles.tiles, layer.tiles.tiles)
+        # the encoded blocks are only copied when saving encoded again
+        teemap = Teemap('test_tmp/skip', lazy=True)
+        self.assertEqual(teemap.to_bytes(), self.teemap.to_bytes())
+        teemap.save('test_tmp/skip2.map', skip_tiles=True)
+        self.assertTrue(filecmp.cmp('test_tmp/skip.map', 'test_tmp/skip2.map'))
+
+        # teeworlds expands the data of each layer in place, identical
+        # encoded layers must not share a block
+        self.teemap.groups[0].layers.extend([items.TileLayer(), items.TileLayer()])
+        self.teemap.save('test_tmp/skip3.map', skip_tiles=True)
+        datafile = DataFileReader('test_tmp/skip3.map', load=False)
+        indices = [ints[14] for type_, id_, ints in datafile.iter_items(ITEM_LAYER)
+                   if ints[1] == LAYERTYPE_TILES]
+        datafile.close()
+        self.assertEqual(len(set(indices)), len(indices))
+
+    def test_only(self):
+        teemap = Teemap('tml/test_maps/vanilla', only='gamelayer')
+        self.assertEqual(len(teemap.groups), 7)
+        self.assertEqual(teemap.layers, [teemap.gamelayer])
+        self.assertEqual(teemap.gamelayer.tiles.tiles,
+                         self.teemap.gamelayer.tiles.tiles)
+        self.assertEqual(teemap.images, [])
+        self.assertEqual(teemap.envelopes, [])
+        self.assertEqual(teemap.envpoints, [])
+
+        teemap = Teemap('tml/test_maps/vanilla', only=['tilelayers', 'envelopes'])
+        self.assertEqual([layer.name for layer in teemap.layers],
+                         ['TestTiles', 'Game', None, 'LastTiles'])
+        self.assertEqual(teemap.images, [])
+        self.assertEqual(len(teemap.envelopes), 2)
+
+        teemap = Teemap('tml/test_maps/vanilla', threads=2,
+                        only=lambda layer: layer.name == 'TestTiles')
+        self.assertEqual(len(teemap.layers), 1)
+        self.assertIsNone(teemap.layers[0].tiles._lazy)
+        self.assertEqual(teemap.layers[0].tiles[4].index, 4)
+        self.assertEqual(len(teemap.images), 3)
+
+        teemap = Teemap('tml/test_maps/vanilla', lazy=True, only='quadlayers')
+        self.assertEqual(len(teemap.layers), 2)
+        self.assertIsNotNone(teemap.layers[1].quads._lazy)
+        self.assertEqual(len(teemap.layers[1].quads), 2)
+
+        self.assertRaises(ValueError, Teemap, 'tml/test_maps/vanilla',
+                          only='gamelayers')
+
+        # partially loaded maps can not be saved
+        self.assertTrue(teemap.partial)
+        self.assertRaises(MapError, teemap.save, 'test_tmp/partial.map')
+        self.assertRaises(MapError, teemap.validate)
+        self.assertFalse(os.path.exists('test_tmp/partial.map'))
+        self.assertFalse(self.teemap.partial)
+        teemap = Teemap('tml/test_maps/vanilla',
+                        only=['info', 'images', 'envelopes', 'layers'])
+        self.assertFalse(teemap.partial)
+
+    def test_cache_dir(self):
+        saved = self.teemap.to_bytes()
+        teemap = Teemap('tml/test_maps/vanilla', cache_dir='test_tmp/cache')
+        self.assertEqual(len(os.listdir('test_tmp/cache')), 1)
+        self.assertEqual(teemap.to_bytes(), saved)
+        sidecar = os.path.join('test_tmp/cache', os.listdir('test_tmp/cache')[0])
+        with open(sidecar, 'rb') as f:
+            self.assertEqual(f.read(4), 'TMLR')
+        for lazy in (False, True):
+            teemap = Teemap('tml/test_maps/vanilla', cache_dir='test_tmp/cache',
+                            lazy=lazy)
+            self.assertEqual(teemap.to_bytes(), saved)
+            self.assertEqual(teemap.images[1].data, self.teemap.images[1].data)
+        self.assertEqual(len(os.listdir('test_tmp/cache')), 1)
+        teemap = Teemap('tml/maps/dm1', cache_dir='test_tmp/cache')
+        self.assertEqual(len(os.listdir('test_tmp/cache')), 2)
+        self.assertEqual(teemap.to_bytes(), Teemap('tml/maps/dm1').to_bytes())
+
     def test_groups(self):
         self.assertEqual(len(self.teemap.groups), 7)
         names = [None, None, 'Game', 'NamedGroup', None, None, 'OtherGroup']
@@ -77,10 +392,8 @@ class TestTeemap(unittest.TestCase):
         self.assertEqual(len(self.teemap.envelopes[0].envpoints), 4)
         self.assertEqual(len(self.teemap.envelopes[1].envpoints), 5)
 
-        for i, envpoint in enumerate(self.teemap.envelopes[0].envpoints):
-            self.assertIs(envpoint, self.teemap.envpoints[i])
-        for i, envpoint in enumerate(self.teemap.envelopes[1].envpoints):
-            self.assertIs(envpoint, self.teemap.envpoints[i+4])
+        self.teemap.envelopes[1].envpoints[0].time = 42
+        self.assertEqual(self.teemap.envpoints[4].time, 42)
 
     def test_images(self):
         images = [None, 'grass_main', 'grass_main', None, 'grass_main', 'test']
@@ -106,6 +419,24 @@ class TestTeemap(unittest.TestCase):
         self.assertTrue(filecmp.cmp('test_tmp/test.png',
                                     'tml/test_mapres/test.png'))
 
+    def test_image_data(self):
+        image = Teemap('tml/test_maps/vanilla').images[1]
+        self.assertIsNotNone(image._lazy)
+        self.assertEqual(len(image.data), image.width * image.height * 4)
+        self.assertIsNone(image._lazy)
+        image = Teemap('tml/test_maps/vanilla', lazy=True).images[1]
+        self.assertIsNotNone(image._lazy)
+        self.assertEqual(image.data, self.teemap.images[1].data)
+
+        self.assertTrue(self.teemap.images[0].validate())
+        self.assertTrue(self.teemap.images[1].validate())
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertFalse(self.teemap.images[2].validate())
+            self.assertEqual(len(w), 1)
+            self.assertEqual(str(w[0].message),
+                             'External image "test2" does not exist')
+
     def test_tiles(self):
         layer = self.teemap.layers[2]
         tiles = layer.tiles
@@ -211,6 +542,23 @@ class TestTeemap(unittest.TestCase):
             self.assertEqual(envpoint.curvetype, curvetypes[i])
             self.assertEqual(envpoint.values, values[i])
 
+    def test_envelope_edits(self):
+        pos_env, color_env = self.teemap.envelopes
+        pos_env.envpoints[1].time = 700
+        pos_env.envpoints.pop(2)
+        color_env.envpoints[4].values = [1024, 1024, 1024, 1024]
+        color_env.envpoints.append(items.Envpoint(2000, 1, [0, 0, 0, 0]))
+        self.assertEqual(self.teemap.envpoints[2].time, 835)
+        self.assertEqual(self.teemap.envpoints[8].values, [1024] * 4)
+
+        teemap = Teemap.from_bytes(self.teemap.to_bytes())
+        self.assertEqual(len(teemap.envpoints), 9)
+        self.assertEqual([len(envelope.envpoints) for envelope
+                          in teemap.envelopes], [3, 6])
+        self.assertEqual([point.time for point in teemap.envpoints],
+                         [0, 700, 2062, 0, 99, 643, 861, 1000, 2000])
+        self.assertEqual(teemap.envelopes[1].envpoints[4].values, [1024] * 4)
+
     def test_save(self):
         self.teemap.save('test_tmp/copy.map')
         self.teemap.save('test_tmp/copy2')
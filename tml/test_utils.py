@@ -2,7 +2,8 @@
 
 import unittest
 
-from utils import ints_to_string, string_to_ints
+from utils import ints_to_string, string_to_ints, parallel_map, \
+     parallel_imap, get_pool, expand_skip_tiles, encode_skip_tiles
 
 TEST_INT = [-186256396, -2139062144, -2139062144, -2139062144, -2139062144,
             -2139062144, -2139062144, -2139062272]
@@ -15,3 +16,25 @@ class TestUtils(unittest.TestCase):
     def test_string_to_ints(self):
         test = string_to_ints('test')
         self.assertEqual(test, TEST_INT)
+
+    def test_skip_tiles(self):
+        air = '\x00\x00\x00\x00'
+        solid = '\x01\x00\x00\x00'
+        data = air * 300 + solid * 2 + '\x01\x02\x05\x00' + air
+        encoded = encode_skip_tiles(data)
+        self.assertEqual(encoded, '\x00\x00\xff\x00\x00\x00\x2b\x00'
+                                  '\x01\x00\x01\x00\x01\x02\x00\x00' + air)
+        self.assertEqual(expand_skip_tiles(encoded, 304),
+                         data.replace('\x05', '\x00'))
+        self.assertEqual(expand_skip_tiles(encoded, 2), air * 2)
+        self.assertEqual(expand_skip_tiles(encoded, 305), data.replace('\x05', '\x00') + air)
+        self.assertEqual(expand_skip_tiles(solid * 3, 3), solid * 3)
+        self.assertEqual(encode_skip_tiles(''), '')
+
+    def test_parallel_map(self):
+        for threads in (1, 4):
+            self.assertEqual(parallel_map(abs, range(-10, 10), threads),
+                             map(abs, range(-10, 10)))
+            self.assertEqual(list(parallel_imap(abs, range(-10, 10), threads)),
+                             map(abs, range(-10, 10)))
+        self.assertIs(get_pool(4), get_pool(4))
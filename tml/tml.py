@@ -8,8 +8,11 @@
     :copyright: 2010-2012 by the TML Team, see AUTHORS for more details.
     :license: GNU GPL, see LICENSE for more details.
 """
+from cStringIO import StringIO
+import multiprocessing
+
 from constants import *
-from datafile import DataFileReader, DataFileWriter
+from datafile import DataFileReader, DataFileWriter, read_cached
 
 class MapError(BaseException):
     """Raised when your map is not a valid teeworlds map.
@@ -21,19 +24,66 @@ class MapError(BaseException):
 class LayerError(MapError):
     pass
 
+class MapSummary(object):
+    """Metadata of a map, returned by :meth:`Teemap.peek`.
+
+    :param name: Name of the map file without extension.
+    :param info: :class:`Info <tml.items.Info>` of the map or ``None``.
+    :param width: Width of the gamelayer.
+    :param height: Height of the gamelayer.
+    :param images: List of image names.
+    :param num_groups: Number of groups.
+    :param num_layers: Number of layers.
+    """
+
+    def __init__(self, name, info=None, width=0, height=0, images=None,
+                 num_groups=0, num_layers=0):
+        self.name = name
+        self.info = info
+        self.width = width
+        self.height = height
+        self.images = images or []
+        self.num_groups = num_groups
+        self.num_layers = num_layers
+
+    def __repr__(self):
+        return '<MapSummary ({0}, {1}x{2})>'.format(self.name, self.width,
+                                                   self.height)
+
 class Teemap(object):
     """Representation of a teeworlds map.
 
     All information about the map can be accessed through this class.
 
     :param map_path: Path to the teeworlds mapfile.
+    :param lazy: Decompress the tiles and quads of a layer only when they are
+                 accessed for the first time.
+    :param threads: Number of threads used to decompress the map data.
+    :param only: Load only some parts of the map, e.g. ``'gamelayer'`` or
+                 ``['tilelayers', 'envelopes']``, or the layers for which the
+                 passed callable returns ``True``. See :class:`DataFileReader
+                 <tml.datafile.DataFileReader>` for all options. A partially
+                 loaded map can not be saved, see :attr:`partial`.
+    :param cache_dir: Directory for an uncompressed copy of the map data,
+                      used to load the same map again without inflating it.
+                      See :func:`read_cached <tml.datafile.read_cached>`.
     """
 
-    def __init__(self, map_path=None):
+    def __init__(self, map_path=None, lazy=False, threads=1, only=None,
+                 cache_dir=None):
         self.name = ''
+        #: ``True`` if the map was loaded with `only` and misses parts.
+        self.partial = False
+        self._source_path = None
 
         if map_path:
-            self._load(map_path)
+            if cache_dir:
+                datafile = read_cached(map_path, cache_dir, lazy=lazy,
+                                       threads=threads, only=only)
+            else:
+                datafile = DataFileReader(map_path, lazy, threads=threads,
+                                          only=only)
+            self._load(datafile)
         else:
             # default item types
             for type_ in ITEM_TYPES:
@@ -96,6 +146,7 @@ class Teemap(object):
         Returns ``True`` or raises an exception.
 
         """
+        self._check_complete()
         gamelayers = 0
         for layer in self.layers:
             if layer.type == 'tilelayer':
@@ -113,21 +164,107 @@ class Teemap(object):
 
         return True
 
-    def _load(self, map_path):
-        """Load a new teeworlds map from `map_path`.
+    @classmethod
+    def from_bytes(cls, data, lazy=False, threads=1, only=None):
+        """Loads a map from the content of a map file.
+
+        :param data: String with the map data.
+        :param lazy: See :class:`Teemap`.
+        :param threads: See :class:`Teemap`.
+        :param only: See :class:`Teemap`.
 
-        Should only be called by __init__.
         """
-        datafile = DataFileReader(map_path)
+        teemap = cls()
+        teemap._load(DataFileReader(data=data, lazy=lazy, threads=threads,
+                                    only=only))
+        return teemap
+
+    @classmethod
+    def from_file(cls, f, lazy=False, threads=1, only=None):
+        """Loads a map from a file-like object opened in binary mode.
+
+        :param f: File-like object, it is read until the end.
+        :param lazy: See :class:`Teemap`.
+        :param threads: See :class:`Teemap`.
+        :param only: See :class:`Teemap`.
+
+        """
+        teemap = cls()
+        teemap._load(DataFileReader(f, lazy=lazy, threads=threads, only=only))
+        return teemap
+
+    def _load(self, datafile):
+        """Load a new teeworlds map from the :class:`DataFileReader
+        <tml.datafile.DataFileReader>`.
+
+        Should only be called by __init__ or the alternative constructors.
+        """
         self.envelopes = datafile.envelopes
         self.envpoints = datafile.envpoints
         self.groups = datafile.groups
         self.images = datafile.images
         self.info = datafile.info
+        self.partial = datafile.partial
+        if datafile.lazy:
+            self._source_path = datafile.mapped_path
+
+    def _check_complete(self):
+        """Raises a MapError if the map was only partially loaded."""
+        if self.partial:
+            raise MapError('The map was only partially loaded, saving it '
+                           'would drop the parts which were skipped.')
+
+    @staticmethod
+    def peek(map_path):
+        """Reads only the metadata of the map at `map_path`.
 
-    def save(self, map_path):
-        """Saves the current map to `map_path`."""
-        DataFileWriter(self, map_path)
+        Only the header and the item table are parsed, apart from the info
+        strings and the image names no data gets decompressed.
+
+        :returns: :class:`MapSummary`
+        :raises: MapError if the map has no gamelayer
+
+        """
+        datafile = DataFileReader(map_path, load=False)
+        try:
+            size = datafile.get_gamelayer_size()
+            if size is None:
+                raise MapError('There is no gamelayer')
+            return MapSummary(datafile.name, info=datafile.load_info(),
+                              width=size[0], height=size[1],
+                              images=datafile.get_image_names(),
+                              num_groups=datafile.get_item_type(ITEM_GROUP)[1],
+                              num_layers=datafile.get_item_type(ITEM_LAYER)[1])
+        finally:
+            datafile.close()
+
+    def save(self, map_path, threads=1, compression='default',
+             skip_tiles=False):
+        """Saves the current map to `map_path`.
+
+        :param map_path: Path to the map or a file-like object opened in
+                         binary mode.
+        :param threads: Number of threads used to compress the map data.
+        :param compression: ``'fast'`` for quick saves with the lowest
+                            compression level, ``'default'`` or
+                            ``'smallest'``, which tries several levels and
+                            strategies for each data block and keeps the
+                            smallest result. Slow, use it for maps which are
+                            distributed.
+        :param skip_tiles: Run-length encode the tiles of tile layers with
+                           their skip field, like teeworlds 0.7 does. Older
+                           clients can not read these maps.
+        :raises: MapError if the map was only partially loaded
+
+        """
+        self._check_complete()
+        DataFileWriter(self, map_path, threads, compression, skip_tiles)
+
+    def to_bytes(self):
+        """Returns the content of the map file as string."""
+        f = StringIO()
+        self.save(f)
+        return f.getvalue()
 
     def _create_default(self):
         """Creates the default map.
@@ -152,3 +289,46 @@ class Teemap(object):
 
     def __repr__(self):
         return '<Teemap ({0})>'.format(self.name or 'new')
+
+def _load_map(map_path):
+    """Loads a single map for :func:`load_many`, errors are returned instead
+    of raised so they can be passed back from the worker process."""
+    try:
+        return (map_path, Teemap(map_path), None)
+    except (Exception, MapError) as e:
+        return (map_path, None, e)
+
+def load_many(map_paths, workers=None, ordered=True):
+    """Loads multiple maps using a pool of processes.
+
+    The maps are yielded as soon as they are loaded. A map which can not be
+    loaded does not abort the batch, its error is yielded instead.
+
+    >>> for path, teemap, error in load_many(paths, workers=4):
+    ...     if error is None:
+    ...         print path, teemap.width, teemap.height
+
+    :param map_paths: Iterable of paths to the maps.
+    :param workers: Number of processes, defaults to the number of cpus. With
+                    1 worker the maps are loaded in the current process.
+    :param ordered: Yield the results in the order of `map_paths`. If
+                    ``False``, they are yielded as they are completed.
+    :returns: Generator of ``(map_path, teemap, error)`` tuples, either
+              `teemap` or `error` is ``None``.
+
+    """
+    if workers == 1:
+        for map_path in map_paths:
+            yield _load_map(map_path)
+        return
+    pool = multiprocessing.Pool(workers)
+    try:
+        if ordered:
+            results = pool.imap(_load_map, map_paths)
+        else:
+            results = pool.imap_unordered(_load_map, map_paths)
+        for result in results:
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
@@ -7,6 +7,12 @@
     :license: GNU GPL, see LICENSE for more details.
 """
 
+from array import array
+from itertools import groupby, imap
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+
 def int32(x):
     if x>0xFFFFFFFF:
         raise OverflowError
@@ -51,3 +57,80 @@ def ints_to_string(num):
         safe_chr(((val>>8)&0xff)-128),
         safe_chr((val&0xff)-128),
     ]) for val in num]).partition('\x00')[0]
+
+_pools = {}
+_pools_pid = None
+_pools_lock = threading.Lock()
+
+def get_pool(threads):
+    """Returns a shared pool of `threads` threads. It is created on first use
+    and kept for the lifetime of the process, starting and joining a pool for
+    every call would cost more than most of the work done with it."""
+    global _pools_pid
+    with _pools_lock:
+        if _pools_pid != os.getpid():
+            # the threads of the pools are not copied into forked processes
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(threads)
+        if pool is None:
+            pool = _pools[threads] = ThreadPool(threads)
+        return pool
+
+def parallel_map(func, iterable, threads=1):
+    """Like :func:`map`, but uses a pool of `threads` threads if more than
+    one thread is requested. Only useful for functions releasing the GIL."""
+    if threads > 1:
+        return get_pool(threads).map(func, iterable)
+    return map(func, iterable)
+
+def parallel_imap(func, iterable, threads=1):
+    """Like :func:`parallel_map`, but returns an iterator which yields the
+    results in order as soon as they are available."""
+    if threads > 1:
+        return get_pool(threads).imap(func, iterable)
+    return imap(func, iterable)
+
+def expand_skip_tiles(data, num_tiles):
+    """Expands tile data which is run-length encoded with the skip field of
+    the tiles, as written by teeworlds 0.7 (tile layer version 4). Each tile
+    is repeated `skip` times.
+
+    :param data: The encoded tile data.
+    :param num_tiles: Number of tiles of the layer, the result is cut or
+                      padded with empty tiles to this size.
+    :returns: The raw tile data with all skip fields set to 0.
+    """
+    data = bytearray(data)
+    skips = data[2::4]
+    if skips.count('\x00') == len(skips):
+        expanded = str(data)
+    else:
+        data[2::4] = bytearray(len(skips))
+        data = str(data)
+        expanded = ''.join([data[i*4:i*4+4] * (skip + 1)
+                            for i, skip in enumerate(skips)])
+    size = num_tiles * 4
+    if len(expanded) < size:
+        return expanded + '\x00' * (size - len(expanded))
+    return expanded[:size]
+
+def encode_skip_tiles(data):
+    """Run-length encodes raw tile data with the skip field of the tiles,
+    the reverse of :func:`expand_skip_tiles`. Runs of equal tiles are
+    stored as one tile with the number of repetitions, at most 255."""
+    data = bytearray(data)
+    data[2::4] = bytearray(len(data) / 4)
+    tiles = array('I', str(data))
+    encoded = array('I')
+    skips = bytearray()
+    for tile, run in groupby(tiles):
+        count = len(list(run))
+        while count:
+            skip = min(count, 256) - 1
+            encoded.append(tile)
+            skips.append(skip)
+            count -= skip + 1
+    encoded = bytearray(encoded.tostring())
+    encoded[2::4] = skips
+    return str(encoded)